@@ -4,8 +4,12 @@ class ImageMseCost():
     def __init__(self):
         pass
 
+    def set_goal(self, goal_img):
+        self._goal_img = goal_img
+
     def __call__(self, inputs):
-        return torch.mean((inputs['goal_img'] - inputs['current_img'])**2, dim=[1,2,3])
+        goal_img = inputs['goal_img'] if 'goal_img' in inputs else self._goal_img
+        return torch.mean((goal_img - inputs['current_img'])**2, dim=[1,2,3])
 
     def get_device(self):
         return torch.device('cpu')
@@ -4,26 +4,22 @@ import numpy as np
 from visual_mpc.policy.cem_controllers.visualizer.construct_html import save_gifs, save_html, save_img, fill_template, img_entry_html, save_imgs, save_gifs_direct, save_imgs_direct, save_img_direct, save_img, save_html_direct
 from visual_mpc.video_prediction.pred_util import get_context, rollout_predictions
 from collections import OrderedDict
-from classifier_control.classifier.utils.DistFuncEvaluation import DistFuncEvaluation
-
-from classifier_control.classifier.models.base_tempdistclassifier import BaseTempDistClassifierTestTime
+from concurrent.futures import ThreadPoolExecutor
+from classifier_control.classifier.utils.traced_cost import TracedCostEvaluation
+from classifier_control.classifier.utils.general_utils import AttrDict
+from classifier_control.classifier.utils.video_resize import resize_batch
 
 from robonet.video_prediction.testing import VPredEvaluation
 import torch
 
 LOG_SHIFT = 1e-5
 
-import cv2
-
 def resample_imgs(images, img_size):
+    """ Bicubic resize of a T x ncam x H x W x 3 sequence (first camera only) or of a single H x W x 3 image """
     if len(images.shape) == 5:
-        resized_images = np.zeros([images.shape[0], 1, img_size[0], img_size[1], 3], dtype=np.uint8)
-        for t in range(images.shape[0]):
-            resized_images[t] = \
-            cv2.resize(images[t].squeeze(), (img_size[1], img_size[0]), interpolation=cv2.INTER_CUBIC)[None]
-        return resized_images
+        return resize_batch(images[:, :1], img_size, backend='cv2', mode='bicubic')
     elif len(images.shape) == 3:
-        return cv2.resize(images, (img_size[1], img_size[0]), interpolation=cv2.INTER_CUBIC)
+        return resize_batch(images[None], img_size, backend='cv2', mode='bicubic')[0]
 
 class LearnedCostController(CEMBaseController):
     """
@@ -40,7 +36,11 @@ class LearnedCostController(CEMBaseController):
         CEMBaseController.__init__(self, ag_params, policyparams)
 
         predictor_hparams = {}
-        predictor_hparams['run_batch_size'] = min(self._hp.vpred_batch_size, self._hp.num_samples)
+        assert self._hp.num_samples % self._hp.pipeline_chunks == 0, \
+            'num_samples {} must be divisible by pipeline_chunks {}, the predictor runs equally sized chunks'.format(
+                self._hp.num_samples, self._hp.pipeline_chunks)
+        n_chunk_samples = self._hp.num_samples // self._hp.pipeline_chunks  # candidates predicted per call
+        predictor_hparams['run_batch_size'] = min(self._hp.vpred_batch_size, n_chunk_samples)
         self.predictor = VPredEvaluation(self._hp.vidpred_model_path, predictor_hparams, n_gpus=ngpu, first_gpu=gpu_id)
         self.predictor.restore(gpu_mem_limit=True)
         self._net_context = self.predictor.n_context
@@ -48,12 +48,28 @@ class LearnedCostController(CEMBaseController):
             self._hp.start_planning = self._net_context - 1
         self.img_sz = self.predictor._input_hparams['img_size']
 
-        learned_cost_testparams = {}
-        learned_cost_testparams['batch_size'] = self._hp.num_samples
-        learned_cost_testparams['data_conf'] = {'img_sz': self.img_sz}  #todo currently uses 64x64!!
-        learned_cost_testparams['classifier_restore_path'] = self._hp.learned_cost_model_path
-        self.learned_cost = DistFuncEvaluation(self._hp.learned_cost, learned_cost_testparams)
-        self.device = self.learned_cost.model.get_device()
+        if self._hp.traced_cost_path:
+            self.learned_cost = TracedCostEvaluation(self._hp.traced_cost_path, self._hp.learned_cost_device,
+                                                     max_batch_size=self._hp.learned_cost_max_batch_size)
+        else:
+            learned_cost_testparams = {}
+            learned_cost_testparams['batch_size'] = self._hp.num_samples
+            learned_cost_testparams['data_conf'] = {'img_sz': self.img_sz}  #todo currently uses 64x64!!
+            learned_cost_testparams['classifier_restore_path'] = self._hp.learned_cost_model_path
+            if self._hp.learned_cost_max_batch_size != -1:
+                learned_cost_testparams['max_batch_size'] = self._hp.learned_cost_max_batch_size
+            if self._hp.learned_cost_device is not None:
+                learned_cost_testparams['device'] = self._hp.learned_cost_device
+            if self._hp.learned_cost_cpu_inference is not None:
+                learned_cost_testparams['cpu_inference'] = self._hp.learned_cost_cpu_inference
+            # imported here, so that traced costs do not need the training code
+            from classifier_control.classifier.utils.DistFuncEvaluation import DistFuncEvaluation
+            learned_cost = self._hp.learned_cost
+            if learned_cost is None:
+                from classifier_control.classifier.models.base_tempdistclassifier import BaseTempDistClassifierTestTime
+                learned_cost = BaseTempDistClassifierTestTime
+            self.learned_cost = DistFuncEvaluation(learned_cost, learned_cost_testparams)
+        self.device = torch.device(self.learned_cost.get_device())
 
         self._net_context = self.predictor.n_context
         if self._hp.start_planning < self._net_context - 1:
@@ -70,6 +86,12 @@ class LearnedCostController(CEMBaseController):
         self._goal_image = None
         self._start_image = None
         self._verbose_worker = None
+        self._score_buffers = None
+        self._resampled_images = None
+        self._n_resampled = 0
+        self._resampled_source = None
+        self._score_executor = None
+        self._score_stream = None
 
     def reset(self):
         self._expert_score = None
@@ -78,8 +100,114 @@ class LearnedCostController(CEMBaseController):
         self._goal_image = None
         self._start_image = None
         self._verbose_worker = None
+        self._clear_resampled()
         return super(LearnedCostController, self).reset()
 
+    def _clear_resampled(self):
+        self._resampled_images = None
+        self._n_resampled = 0
+        self._resampled_source = None
+
+    def _resample_history(self, images):
+        """
+        Resized image history of the episode. Frames resized in earlier calls are cached, so only frames added since the
+        last call are resized. The cache is keyed on the array owning the memory of images, views of the same history
+        buffer share it, a different array starts a new cache.
+        :param images: T x ncam x H x W x 3 image history, extended by new frames between calls
+        :return: T x 1 x img_sz[0] x img_sz[1] x 3
+        """
+        source = images
+        while isinstance(source.base, np.ndarray):
+            source = source.base
+        if source is not self._resampled_source:
+            self._clear_resampled()
+            self._resampled_source = source
+        n_frames = images.shape[0]
+        if self._resampled_images is None or n_frames < self._n_resampled:
+            self._n_resampled = 0
+        if self._resampled_images is None or self._resampled_images.shape[0] < n_frames:
+            capacity = n_frames if self._resampled_images is None else max(n_frames, 2 * self._resampled_images.shape[0])
+            resampled_images = np.empty([capacity, 1, self.img_sz[0], self.img_sz[1], 3], dtype=images.dtype)
+            if self._n_resampled > 0:
+                resampled_images[:self._n_resampled] = self._resampled_images[:self._n_resampled]
+            self._resampled_images = resampled_images
+        if n_frames > self._n_resampled:
+            self._resampled_images[self._n_resampled:n_frames] = \
+                resample_imgs(images[self._n_resampled:n_frames], self.img_sz)
+            self._n_resampled = n_frames
+        return self._resampled_images[:n_frames]
+
+    def _get_score_buffers(self, n_frames):
+        """
+        Staging buffers for scoring n_frames predicted frames: a (pinned if on gpu) host buffer and device buffers for
+        the frames and the network input. They are allocated on the first replan, kept across replans and episodes and
+        only reallocated if the number of frames changes.
+        """
+        frame_shape = (self.img_sz[0], self.img_sz[1], 3)
+        if self._score_buffers is None or self._score_buffers.host.shape[0] != n_frames:
+            host = torch.empty((n_frames,) + frame_shape, dtype=torch.float32, pin_memory=self.device.type == 'cuda')
+            self._score_buffers = AttrDict(
+                host=host,
+                host_np=host.numpy(),
+                frames=torch.empty((n_frames,) + frame_shape, dtype=torch.float32, device=self.device),
+                input=torch.empty((n_frames, 3) + frame_shape[:2], dtype=torch.float32, device=self.device),
+            )
+        return self._score_buffers
+
+    def _score_predictions(self, gen_images, buffers):
+        """
+        Scores all time steps of the predicted frames in one batch
+        :param gen_images: num_samples x horizon x ncam x height x width x 3 predictions in [0, 1]
+        :param buffers: staging buffers for exactly num_samples * horizon frames
+        :return: scores, num_samples x horizon
+        """
+        num_samples, horizon = gen_images.shape[:2]
+        np.copyto(buffers.host_np.reshape((num_samples, horizon) + buffers.host_np.shape[1:]), gen_images[:, :, 0])
+        buffers.frames.copy_(buffers.host, non_blocking=True)
+        # channel-first and [-1, 1] range, written into the input buffer
+        buffers.input.copy_(buffers.frames.permute(0, 3, 1, 2)).mul_(2).sub_(1)
+        inp_dict = {'current_img': buffers.input}   # compared to the goal set in act
+        scores = self.learned_cost.predict(inp_dict)
+        if torch.is_tensor(scores):
+            scores = scores.cpu().numpy()
+        return scores.reshape(num_samples, horizon)
+
+    def _score_predictions_async(self, gen_images, buffers):
+        """ Runs in the scoring worker thread, on a separate cuda stream if the cost runs on gpu """
+        if self.device.type != 'cuda':
+            return self._score_predictions(gen_images, buffers)
+        if self._score_stream is None:
+            self._score_stream = torch.cuda.Stream(self.device)
+        self._score_stream.wait_stream(torch.cuda.current_stream(self.device))
+        with torch.cuda.stream(self._score_stream):
+            return self._score_predictions(gen_images, buffers)
+
+    def _predict_and_score_pipelined(self, context, actions):
+        """
+        Splits the candidates into pipeline_chunks chunks of equal size. While a worker thread scores the predictions
+        of chunk k, the predictions of chunk k + 1 are generated. The scores are reassembled in the order of the
+        candidates.
+        :return: predicted frames and scores of all candidates
+        """
+        if self._score_executor is None:
+            self._score_executor = ThreadPoolExecutor(max_workers=1)
+        gen_images, futures = [], []
+        buffers, start = None, 0
+        for chunk_actions in np.split(actions, self._hp.pipeline_chunks, axis=0):
+            chunk_images = self.predictor(context, {'actions': chunk_actions})['predicted_frames']
+            horizon = chunk_images.shape[1]
+            if buffers is None:
+                buffers = self._get_score_buffers(actions.shape[0] * horizon)
+            # every chunk uses its own slice of the staging buffers
+            stop = start + chunk_images.shape[0]
+            chunk_buffers = AttrDict({key: value[start * horizon:stop * horizon] for key, value in buffers.items()})
+            futures.append(self._score_executor.submit(self._score_predictions_async, chunk_images, chunk_buffers))
+            gen_images.append(chunk_images)
+            start = stop
+
+        scores = np.concatenate([future.result() for future in futures], axis=0)
+        return np.concatenate(gen_images, axis=0), scores
+
     def _default_hparams(self):
         default_dict = {
             'finalweight': 10,
@@ -90,7 +218,12 @@ class LearnedCostController(CEMBaseController):
             'vidpred_model_path': '',
             'learned_cost_model_path': '',
             'vpred_batch_size': 200,
-            'learned_cost': BaseTempDistClassifierTestTime
+            'learned_cost': None,  # test-time model class, None for BaseTempDistClassifierTestTime
+            'learned_cost_max_batch_size': -1,  # overrides the max batch size of the learned cost model if not -1
+            'traced_cost_path': '',  # if set, the cost is a module exported with export_traced_cost.py
+            'learned_cost_device': None,  # 'cpu', 'cuda:<i>' or gpus to shard over, e.g. 'cuda:0,cuda:1'; None picks the first gpu or cpu
+            'learned_cost_cpu_inference': None,  # dict of CPU inference options, see cpu_inference.py, None runs on gpu
+            'pipeline_chunks': 1,  # if > 1, the candidates are predicted in chunks and scored while the next chunk is predicted, must divide num_samples
         }
         parent_params = super(LearnedCostController, self)._default_hparams()
 
@@ -100,32 +233,26 @@ class LearnedCostController(CEMBaseController):
 
     def evaluate_rollouts(self, actions, cem_itr):
         previous_actions = np.concatenate([x[None] for x in self._sampler.chosen_actions[-self._net_context:]], axis=0)
-        previous_actions = np.tile(previous_actions, [actions.shape[0], 1, 1])
         # input_actions = np.concatenate((previous_actions, actions), axis=1)[:, :self.predictor.sequence_length]
 
-        resampled_imgs = resample_imgs(self._images, self.img_sz)
+        resampled_imgs = self._resample_history(self._images)
         last_frames, last_states = get_context(self._net_context, self._t,
                                                self._state, resampled_imgs, self._hp)
         context = {
             "context_frames": last_frames[0],  #only take first batch example
-            "context_actions": previous_actions[0],
+            "context_actions": previous_actions,
             "context_states": last_states[0]
         }
-        prediction_dict = self.predictor(context, {'actions': actions})
-        gen_images = prediction_dict['predicted_frames']
-
-        scores = []
-
-        for tpred in range(gen_images.shape[1]):
-            input_images = ten2pytrch(gen_images[:, tpred], self.device)
-            inp_dict = {'current_img': input_images,
-                        'goal_img': uint2pytorch(resample_imgs(self._goal_image, self.img_sz), self._hp.num_samples, self.device)}
-
-            print('peform prediction for ', tpred)
-            scores.append(self.learned_cost.predict(inp_dict))
+        if self._hp.pipeline_chunks > 1:
+            gen_images, scores = self._predict_and_score_pipelined(context, actions)
+        else:
+            prediction_dict = self.predictor(context, {'actions': actions})
+            gen_images = prediction_dict['predicted_frames']
+            # score the predictions of all samples and time steps in one batch
+            num_samples, horizon = gen_images.shape[:2]
+            scores = self._score_predictions(gen_images, self._get_score_buffers(num_samples * horizon))
 
         # weight final time step by some number and average over time.
-        scores = np.stack(scores, 1)
         scores = self._weight_scores(scores)
 
         if self._verbose_condition(cem_itr):
@@ -151,7 +278,9 @@ class LearnedCostController(CEMBaseController):
                 content_dict[row_name] = save_gifs_direct(verbose_folder,
                                                        row_name, verbose_images)
 
-            self.learned_cost.model.visualize_test_time(content_dict, visualize_indices, verbose_folder)
+            if self._hp.pipeline_chunks == 1:
+                # with pipelining the cost model only holds the outputs of the last chunk
+                self.learned_cost.visualize_test_time(content_dict, visualize_indices, verbose_folder)
 
             # save scores
             content_dict['scores'] = scores[visualize_indices]
@@ -175,6 +304,8 @@ class LearnedCostController(CEMBaseController):
 
 
     def act(self, t=None, i_tr=None, images=None, goal_image=None, verbose_worker=None, state=None):
+        if t == 0:
+            self._clear_resampled()     # a new trajectory may reuse the history buffer of the last one
         self._images = images
         self._verbose_worker = verbose_worker
         ### Support for getting goal images from environment
@@ -182,16 +313,11 @@ class LearnedCostController(CEMBaseController):
           self._goal_image = goal_image[0]
         else:
           self._goal_image = goal_image[-1, 0]  # pick the last time step as the goal image
+        self.learned_cost.set_goal(uint2pytorch(resample_imgs(self._goal_image, self.img_sz), 1, self.device))
 
         return super(LearnedCostController, self).act(t, i_tr, state)
 
 
-def ten2pytrch(img, device):
-    """Converts images to the [-1...1] range of the hierarchical planner."""
-    img = img[:, 0]
-    img = np.transpose(img, [0, 3, 1, 2])
-    return torch.from_numpy(img * 2 - 1.0).float().to(device)
-
 def uint2pytorch(img, num_samples, device):
     img = np.tile(img[None], [num_samples, 1, 1, 1])
     img = np.transpose(img, [0, 3, 1, 2])
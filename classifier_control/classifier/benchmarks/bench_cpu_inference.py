@@ -0,0 +1,61 @@
+""" Candidates/sec of a learned cost on the CPU, eager fp32 vs. the optimized cpu_inference mode of DistFuncEvaluation
+
+usage: python bench_cpu_inference.py <model class> <checkpoint> [--img_sz 64 64] [--batch_sizes 100 200 1300]
+    [--num_threads 8] [--bf16]
+"""
+import argparse
+import time
+
+import torch
+
+from classifier_control.classifier.utils.DistFuncEvaluation import DistFuncEvaluation
+from classifier_control.classifier.utils.export_traced_cost import load_model_class
+
+
+def candidates_per_sec(evaluation, inputs, n_iter):
+    evaluation.predict(inputs)
+    start = time.time()
+    for _ in range(n_iter):
+        evaluation.predict(inputs)
+    return n_iter * inputs['current_img'].shape[0] / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model', help='test-time model class, e.g. '
+                                      'classifier_control.classifier.models.base_tempdistclassifier.'
+                                      'BaseTempDistClassifierTestTime')
+    parser.add_argument('checkpoint', help='weights file, params.yaml is expected two directories above')
+    parser.add_argument('--img_sz', nargs=2, type=int, default=[64, 64])
+    parser.add_argument('--batch_sizes', nargs='+', type=int, default=[100, 200, 1300])
+    parser.add_argument('--num_threads', default=None, type=int)
+    parser.add_argument('--bf16', action='store_true')
+    parser.add_argument('--n_iter', default=10, type=int)
+    args = parser.parse_args()
+
+    model_class = load_model_class(args.model)
+    testparams = {
+        'batch_size': max(args.batch_sizes),
+        'data_conf': {'img_sz': args.img_sz},
+        'classifier_restore_path': args.checkpoint,
+    }
+    baseline = DistFuncEvaluation(model_class, dict(testparams, cpu_inference={
+        'fold_batchnorm': False, 'channels_last': False, 'bf16': False, 'num_threads': args.num_threads}))
+    optimized = DistFuncEvaluation(model_class, dict(testparams, cpu_inference={
+        'bf16': args.bf16, 'num_threads': args.num_threads}))
+
+    for batch_size in args.batch_sizes:
+        inputs = {'current_img': torch.rand(batch_size, 3, args.img_sz[0], args.img_sz[1]) * 2 - 1,
+                  'goal_img': torch.rand(batch_size, 3, args.img_sz[0], args.img_sz[1]) * 2 - 1}
+        # the Q-functions sample random actions, their scores differ between calls
+        max_diff = (torch.as_tensor(baseline.predict(inputs)) - torch.as_tensor(optimized.predict(inputs))).abs().max()
+
+        baseline_rate = candidates_per_sec(baseline, inputs, args.n_iter)
+        optimized_rate = candidates_per_sec(optimized, inputs, args.n_iter)
+        print('batch {:5d}: eager fp32 {:.0f} candidates/sec, optimized {:.0f} candidates/sec, speedup {:.2f}x, '
+              'max score difference {:.2e}'.format(batch_size, baseline_rate, optimized_rate,
+                                                   optimized_rate / baseline_rate, max_diff.item()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+""" Times DistributionalTarget against the previous per-example loop of DistQFunction.loss
+
+The equivalence of both is tested in tests/test_distributional_target.py.
+
+usage: python bench_dist_target.py [--n_action_samples 100] [--n_bins 10] [--n_iter 100]
+"""
+import argparse
+import time
+
+import torch
+
+from classifier_control.classifier.models.utils.distributional_target import DistributionalTarget
+from classifier_control.classifier.tests.test_distributional_target import distributional_target_loop
+
+
+def time_call(fn, n_iter, device):
+    fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.time()
+    for _ in range(n_iter):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.time() - start) / n_iter * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_action_samples', default=100, type=int)
+    parser.add_argument('--n_bins', default=10, type=int)
+    parser.add_argument('--n_iter', default=100, type=int)
+    args = parser.parse_args()
+    device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+    distributional_target = DistributionalTarget(args.n_bins)
+
+    for batch_size in [32, 64, 256]:
+        qs = torch.softmax(torch.randn(args.n_action_samples, batch_size * 2, args.n_bins, device=device), 2)
+        labels = torch.cat([torch.ones(batch_size, device=device), torch.zeros(batch_size, device=device)])
+        loop_ms = time_call(lambda: distributional_target_loop(qs, labels, args.n_bins), args.n_iter, device)
+        batched_ms = time_call(lambda: distributional_target(qs, labels), args.n_iter, device)
+        print('batch {:4d}: loop {:.3f} ms, batched {:.3f} ms, speedup {:.1f}x'.format(
+            batch_size * 2, loop_ms, batched_ms, loop_ms / batched_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+""" Micro-benchmark for FixLenVideoDataset.__getitem__ with and without the HDF5 handle pool.
+
+usage: python bench_hdf5_pool.py [--n_files 8] [--traj_per_file 16] [--T 31] [--data_dir <existing dataset>]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from classifier_control.classifier.utils.general_utils import AttrDict
+from classifier_control.classifier.datasets.data_loader import FixLenVideoDataset
+
+
+def make_synthetic_dataset(data_dir, n_files, traj_per_file, T, img_sz=(48, 64)):
+    """ Writes a dataset with the layout expected by FixLenVideoDataset into data_dir/hdf5/train """
+    os.makedirs(os.path.join(data_dir, 'hdf5', 'train'))
+    for i_file in range(n_files):
+        with h5py.File(os.path.join(data_dir, 'hdf5', 'train', 'traj{}.h5'.format(i_file)), 'w') as F:
+            F['traj_per_file'] = traj_per_file
+            for i_traj in range(traj_per_file):
+                key = 'traj{}'.format(i_traj)
+                F[key + '/images'] = np.random.randint(0, 255, [T, img_sz[0], img_sz[1], 3], dtype=np.uint8)
+                F[key + '/states'] = np.random.randn(T, 4).astype(np.float32)
+                F[key + '/actions'] = np.random.randn(T - 1, 2).astype(np.float32)
+
+
+def items_per_sec(dataset, n_passes):
+    start = time.time()
+    for _ in range(n_passes):
+        for index in range(len(dataset)):
+            dataset[index]
+    return n_passes * len(dataset) / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_dir', default=None, help='existing dataset, a synthetic one is created if not given')
+    parser.add_argument('--n_files', default=8, type=int)
+    parser.add_argument('--traj_per_file', default=16, type=int)
+    parser.add_argument('--T', default=31, type=int)
+    parser.add_argument('--n_passes', default=3, type=int)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir
+        if data_dir is None:
+            data_dir = tmp_dir
+            make_synthetic_dataset(data_dir, args.n_files, args.traj_per_file, args.T)
+
+        mpar = AttrDict(img_sz=(64, 64))
+        for pool_size in [0, 8]:
+            data_conf = AttrDict(img_sz=(64, 64), sel_len=-1, T=args.T, hdf5_pool_size=pool_size)
+            dataset = FixLenVideoDataset(data_dir, mpar, data_conf, phase='train')
+            print('pool size {}: {:.1f} items/sec'.format(pool_size, items_per_sec(dataset, args.n_passes)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+""" Benchmark of the batched resize backends in video_resize.py, with their pixel differences to PIL
+
+The PIL parity of the default backend is tested in tests/test_video_resize.py.
+
+usage: python bench_resize.py [--n_iter 20]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from classifier_control.classifier.utils.video_resize import BACKENDS, resize_batch
+
+
+def time_call(fn, n_iter):
+    start = time.time()
+    for _ in range(n_iter):
+        fn()
+    return (time.time() - start) / n_iter * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_iter', default=20, type=int)
+    args = parser.parse_args()
+
+    # upsampling as for the 48x64 datasets and downsampling as for full resolution recordings
+    for src_sz, target_sz in [((48, 64), (64, 64)), ((240, 320), (64, 64))]:
+        for batch_shape in [(31,), (50,), (32, 31)]:
+            video = np.random.randint(0, 255, batch_shape + src_sz + (3,), dtype=np.uint8)
+            reference = resize_batch(video, target_sz, backend='pil')
+
+            print('input {} -> {}'.format(video.shape, target_sz))
+            for backend in list(BACKENDS.keys()) + ['default', 'auto']:
+                resized = resize_batch(video, target_sz, backend=backend)
+                diff = np.abs(resized.astype(np.int32) - reference.astype(np.int32))
+
+                ms = time_call(lambda: resize_batch(video, target_sz, backend=backend), args.n_iter)
+                print('  {:7s} {:8.2f} ms  max diff {}  mean diff {:.3f}'.format(backend, ms, diff.max(), diff.mean()))
+
+
+if __name__ == '__main__':
+    main()
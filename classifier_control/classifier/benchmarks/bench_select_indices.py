@@ -0,0 +1,51 @@
+""" Benchmark of the batched select_indices gather against the previous per-example loop
+
+usage: python bench_select_indices.py [--T 31] [--n_iter 100]
+"""
+import argparse
+import time
+
+import torch
+
+from classifier_control.classifier.models.utils.utils import select_indices
+
+
+def select_indices_loop(tensor, indices):
+    new_images = []
+    for b in range(tensor.shape[0]):
+        new_images.append(tensor[b, indices[b]])
+    return torch.stack(new_images, dim=0)
+
+
+def time_call(fn, n_iter, device):
+    fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.time()
+    for _ in range(n_iter):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.time() - start) / n_iter * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--T', default=31, type=int)
+    parser.add_argument('--n_iter', default=100, type=int)
+    args = parser.parse_args()
+    device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+
+    for batch_size in [32, 64, 256]:
+        images = torch.randn(batch_size, args.T, 3, 64, 64, device=device)
+        indices = torch.randint(0, args.T, (batch_size,))
+        assert torch.equal(select_indices(images, indices), select_indices_loop(images, indices))
+
+        loop_ms = time_call(lambda: select_indices_loop(images, indices), args.n_iter, device)
+        gather_ms = time_call(lambda: select_indices(images, indices), args.n_iter, device)
+        print('batch {:4d}: loop {:.3f} ms, gather {:.3f} ms, speedup {:.1f}x'.format(
+            batch_size, loop_ms, gather_ms, loop_ms / gather_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+""" Exports a learned cost on one device and loads the traced module with TracedCostEvaluation on another one
+
+The traced scores are compared to the eager model on the load device. The Q-functions sample random actions, for them
+only the shapes and the device of the scores are checked.
+
+usage: python check_traced_cost_device.py <model class> <checkpoint> [--img_sz 64 64] [--export_device cuda]
+    [--load_device cpu]
+"""
+import argparse
+import os
+import tempfile
+
+import torch
+
+from classifier_control.classifier.utils.DistFuncEvaluation import DistFuncEvaluation
+from classifier_control.classifier.utils.export_traced_cost import export, load_model_class
+from classifier_control.classifier.utils.traced_cost import TracedCostEvaluation
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model', help='test-time model class, e.g. '
+                                      'classifier_control.classifier.models.base_tempdistclassifier.'
+                                      'BaseTempDistClassifierTestTime')
+    parser.add_argument('checkpoint', help='weights file, params.yaml is expected two directories above')
+    parser.add_argument('--img_sz', nargs=2, type=int, default=[64, 64])
+    parser.add_argument('--batch_size', default=16, type=int)
+    parser.add_argument('--export_device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--load_device', default='cpu')
+    args = parser.parse_args()
+    if args.export_device == args.load_device:
+        print('export and load device are both {}, the check is not cross-device'.format(args.load_device))
+
+    model_class = load_model_class(args.model)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        traced_path = os.path.join(tmp_dir, 'cost.pt')
+        export(model_class, args.checkpoint, traced_path, args.img_sz, args.batch_size, args.export_device)
+        traced = TracedCostEvaluation(traced_path, args.load_device)
+
+    eager = DistFuncEvaluation(model_class, {
+        'batch_size': args.batch_size,
+        'data_conf': {'img_sz': args.img_sz},
+        'classifier_restore_path': args.checkpoint,
+        'device': args.load_device,
+    })
+    inputs = {'current_img': torch.rand(args.batch_size, 3, args.img_sz[0], args.img_sz[1]) * 2 - 1,
+              'goal_img': torch.rand(args.batch_size, 3, args.img_sz[0], args.img_sz[1]) * 2 - 1}
+    inputs = {key: value.to(traced.get_device()) for key, value in inputs.items()}
+    traced_scores = traced.predict(inputs)
+    eager_scores = torch.as_tensor(eager.predict(inputs))
+
+    assert traced_scores.shape == eager_scores.shape, \
+        'traced scores {} vs eager scores {}'.format(tuple(traced_scores.shape), tuple(eager_scores.shape))
+    assert traced_scores.device == traced.get_device(), \
+        'traced scores on {}, expected {}'.format(traced_scores.device, traced.get_device())
+    max_diff = (traced_scores - eager_scores.to(traced_scores.device)).abs().max().item()
+    print('exported on {}, loaded on {}: max score difference traced vs eager {:.2e}'.format(
+        args.export_device, args.load_device, max_diff))
+    if 'QFunction' not in model_class.__name__:
+        assert max_diff < 1e-4, 'traced scores differ from the eager model on {}'.format(args.load_device)
+
+
+if __name__ == '__main__':
+    main()
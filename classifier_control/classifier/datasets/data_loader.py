@@ -1,7 +1,9 @@
+import torch
 import torch.utils.data as data
 import numpy as np
 from PIL import Image
 import glob
+import inspect
 import h5py
 import random
 import pdb
@@ -9,11 +11,12 @@ import matplotlib.pyplot as plt
 import imageio
 from torchvision.transforms import Resize
 import imp
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, BatchSampler, RandomSampler, SequentialSampler
 import os
 import moviepy.editor as mpy
 from classifier_control.classifier.utils.general_utils import AttrDict, map_dict
-from classifier_control.classifier.utils.general_utils import resize_video
+from classifier_control.classifier.datasets.hdf5_pool import HDF5HandlePool
+from classifier_control.classifier.datasets.frame_cache import FrameCache, preprocess_frames
 
 class BaseVideoDataset(data.Dataset):
     def __init__(self, data_dir, mpar, data_conf, phase, shuffle=True):
@@ -34,17 +37,66 @@ class BaseVideoDataset(data.Dataset):
         self.shuffle = shuffle and phase == 'train'
         self.img_sz = mpar.img_sz
 
-        if shuffle:
-            self.n_worker = 4
-        else:
-            self.n_worker = 1
-        #todo debug:
-        self.n_worker = 0
+        # loading in the main process unless data_conf sets n_worker, e.g. 4 for training and 1 for validation
+        self.n_worker = data_conf.get('n_worker', 0)
+        self.pin_memory = data_conf.get('pin_memory', torch.cuda.is_available())
 
     def get_data_loader(self, batch_size):
         print('len {} dataset {}'.format(self.phase, len(self)))
+        worker_kwargs = get_worker_kwargs(self.data_conf, self.n_worker)
         return DataLoader(self, batch_size=batch_size, shuffle=self.shuffle, num_workers=self.n_worker,
-                                  drop_last=True)
+                          pin_memory=self.pin_memory, drop_last=True, **worker_kwargs)
+
+
+def get_worker_kwargs(data_conf, n_worker):
+    """
+    DataLoader kwargs for the worker processes. prefetch_factor (batches loaded in advance by every worker) and
+    persistent_workers are only passed if data_conf sets them, they need torch >= 1.7 and are ignored otherwise.
+    """
+    if n_worker == 0:
+        return {}
+    kwargs = dict(worker_init_fn=seed_worker)
+    supported = inspect.signature(DataLoader.__init__).parameters
+    for name in ['prefetch_factor', 'persistent_workers']:
+        if name not in data_conf:
+            continue
+        if name in supported:
+            kwargs[name] = data_conf[name]
+        else:
+            print('{} is not supported by torch {}, ignoring it'.format(name, torch.__version__))
+    return kwargs
+
+
+def seed_worker(worker_id):
+    """ Gives every worker its own numpy seed, otherwise all workers draw identical random shifts.
+    torch seeds worker i with base_seed + i, base_seed is drawn anew whenever the workers are started. """
+    seed = torch.initial_seed() % 2**32
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def get_batched_data_loader(dataset, sampler, batch_size):
+    """
+    DataLoader for datasets whose __getitem__ takes a list of indices and returns the whole batch, which avoids
+    per-item indexing and collation. Every loader item is one index list of a BatchSampler, drop_last as usual.
+    """
+    worker_kwargs = get_worker_kwargs(dataset.data_conf, dataset.n_worker)
+    return DataLoader(dataset, sampler=BatchSampler(sampler, batch_size, drop_last=True), batch_size=1,
+                      collate_fn=collate_batched, num_workers=dataset.n_worker, pin_memory=dataset.pin_memory,
+                      **worker_kwargs)
+
+
+def collate_batched(items):
+    """ Unpacks the single batch of a get_batched_data_loader item and converts its arrays to tensors """
+    return map_dict(torch.from_numpy, items[0])
+
+
+def normalize_images(images):
+    """ Converts a batch of uint8 frames, as served with uint8_images or from the frame cache, to float in [-1, 1].
+    Meant to run on the device after the transfer, float inputs are returned unchanged. """
+    if images.dtype != torch.uint8:
+        return images
+    return images.float().div_(255).mul_(2).sub_(1)
 
 
 class FixLenVideoDataset(BaseVideoDataset):
@@ -52,7 +104,7 @@ class FixLenVideoDataset(BaseVideoDataset):
     Variable length video dataset
     """
 
-    def __init__(self, data_dir, mpar, data_conf, phase='train', shuffle=True):
+    def __init__(self, data_dir, mpar, data_conf, phase='train', shuffle=True, frame_sampler=None):
         """
 
         :param data_dir:
@@ -61,9 +113,17 @@ class FixLenVideoDataset(BaseVideoDataset):
         :param phase:
         :param shuffle: whether to shuffle within batch, set to False for computing metrics
         :param dataset_size:
+        :param frame_sampler: FrameSampler of the model, required if data_conf.sparse_frames is set. Only the frames
+        it draws are read, demo_seq_images then holds them in slot order and frame_inds their time indices
         """
         super().__init__(data_dir, mpar, data_conf, phase, shuffle)
 
+        self._frame_sampler = None
+        if data_conf.get('sparse_frames', False):
+            if frame_sampler is None:
+                raise ValueError('sparse_frames requires the frame sampler of the model')
+            self._frame_sampler = frame_sampler
+
         self.filenames = self._maybe_post_split(self._get_filenames())
         random.seed(1)
         random.shuffle(self.filenames)
@@ -79,6 +139,17 @@ class FixLenVideoDataset(BaseVideoDataset):
         self.flatten_im = False
         self.filter_repeated_tail = False
 
+        # every DataLoader worker ends up with its own copy of the pool
+        self._file_pool = HDF5HandlePool(data_conf.get('hdf5_pool_size', 8))
+
+        # keep the frames uint8 through collation and pinning, normalize_images converts them on the device
+        self.uint8_images = data_conf.get('uint8_images', False)
+
+        # serve preprocessed uint8 frames written by frame_cache.py, normalization happens on the device
+        self._frame_cache = None
+        if data_conf.get('use_frame_cache', False):
+            self._frame_cache = FrameCache(data_dir, phase, self.img_sz, self.traj_per_file)
+
         print(phase)
         print(len(self.filenames))
 
@@ -98,33 +169,78 @@ class FixLenVideoDataset(BaseVideoDataset):
             return F['traj0']['images'].value.shape[0]
 
     def __getitem__(self, index):
+        if self._frame_sampler is not None:
+            return self._get_sparse_item(index)
+
+        data_dict = self.load_trajectory(index)
+        if self._frame_cache is None:
+            data_dict = self.process_data_dict(data_dict)
+        if self._data_conf.sel_len != -1:
+            data_dict = self.sample_rand_shifts(data_dict)
+
+        return data_dict
+
+    def load_trajectory(self, index, read_inds=None):
+        """
+        Reads a trajectory without any preprocessing of the images or random shifts
+        :param read_inds: increasing time indices of the frames to read, None reads all frames
+        :return: AttrDict with float32 states, actions and pad_mask and either the stored uint8 frames as images or,
+        with the frame cache, the preprocessed uint8 frames as demo_seq_images
+        """
         file_index = index // self.traj_per_file
         path = self.filenames[file_index]
 
-        with h5py.File(path, 'r') as F:
-            ex_index = index % self.traj_per_file  # get the index
-            key = 'traj{}'.format(ex_index)
-
-            # Fetch data into a dict
-            data_dict = AttrDict(images=(F[key + '/images'].value))
+        ex_index = index % self.traj_per_file  # get the index
+        key = 'traj{}'.format(ex_index)
+
+        # Fetch data into a dict
+        data_dict = AttrDict()
+        with self._file_pool.open(path) as F:
+            if self._frame_cache is None:
+                if read_inds is None:
+                    data_dict.images = F[key + '/images'].value
+                else:
+                    data_dict.images = F[key + '/images'][read_inds]
             for name in F[key].keys():
                 if name in ['states', 'actions', 'pad_mask']:
                     data_dict[name] = F[key + '/' + name].value.astype(np.float32)
 
-        data_dict = self.process_data_dict(data_dict)
-        if self._data_conf.sel_len != -1:
-            data_dict = self.sample_rand_shifts(data_dict)
+        if self._frame_cache is not None:
+            frames = self._frame_cache.get(path, ex_index)
+            data_dict.demo_seq_images = frames if read_inds is None else frames[read_inds]
+        return data_dict
 
+    def _get_sparse_item(self, index):
+        """ Like __getitem__, but only reads and preprocesses the frames drawn by the frame sampler """
+        if self._data_conf.sel_len != -1:
+            offset = np.random.randint(0, self.T - self._data_conf.sel_len, 1)
+            frame_inds = self._frame_sampler(self._data_conf.sel_len)
+        else:
+            offset = 0
+            frame_inds = self._frame_sampler(self.T)
+        # h5py selections need increasing indices, every frame is read once and the slots are filled afterwards
+        read_inds, slot_rows = np.unique(frame_inds + offset, return_inverse=True)
+
+        data_dict = self.load_trajectory(index, read_inds)
+        if self._frame_cache is None:
+            images = self.preprocess_images(data_dict.pop('images'))
+        else:
+            images = data_dict.pop('demo_seq_images')
+        if self._data_conf.sel_len != -1:
+            data_dict = self.sample_rand_shifts(data_dict, offset)
+        data_dict.demo_seq_images = images[slot_rows]
+        data_dict.frame_inds = frame_inds
         return data_dict
 
     def process_data_dict(self, data_dict):
         data_dict.demo_seq_images = self.preprocess_images(data_dict['images'])
         return data_dict
 
-    def sample_rand_shifts(self, data_dict):
+    def sample_rand_shifts(self, data_dict, offset=None):
         """ This function processes data tensors so as to have length equal to max_seq_len
         by sampling / padding if necessary """
-        offset = np.random.randint(0, self.T - self._data_conf.sel_len, 1)
+        if offset is None:
+            offset = np.random.randint(0, self.T - self._data_conf.sel_len, 1)
 
         data_dict = map_dict(lambda tensor: self._croplen(tensor, offset, self._data_conf.sel_len), data_dict)
         if 'actions' in data_dict:
@@ -134,13 +250,12 @@ class FixLenVideoDataset(BaseVideoDataset):
 
     def preprocess_images(self, images):
         # Resize video
-        if len(images.shape) == 5:
-            images = images[:, 0]  # Number of cameras, used in RL environments
-        assert images.dtype == np.uint8, 'image need to be uint8!'
-        images = resize_video(images, (self.img_sz[0], self.img_sz[1]))
-        images = np.transpose(images, [0, 3, 1, 2])  # convert to channel-first
-        images = images.astype(np.float32) / 255 * 2 - 1
-        assert images.dtype == np.float32, 'image need to be float32!'
+        images = preprocess_frames(images, self.img_sz)
+        if self.uint8_images:
+            images = np.ascontiguousarray(images)
+        else:
+            images = images.astype(np.float32) / 255 * 2 - 1
+            assert images.dtype == np.float32, 'image need to be float32!'
         if self.flatten_im:
             images = np.reshape(images, [images.shape[0], -1])
         return images
@@ -194,6 +309,65 @@ class FixLenVideoDataset(BaseVideoDataset):
         return imp.load_source('dataset_spec', os.path.join(data_dir, 'dataset_spec.py')).dataset_spec
 
 
+class LowDimDataset(FixLenVideoDataset):
+    """
+    State-only dataset for low_dim training: the states and actions of all trajectories are loaded into one array
+    each at startup and the images are never read. Batches are gathered from memory with one indexing operation.
+    """
+
+    def __init__(self, data_dir, mpar, data_conf, phase='train', shuffle=True):
+        BaseVideoDataset.__init__(self, data_dir, mpar, data_conf, phase, shuffle)
+        # the data is in memory, workers would only copy it
+        self.n_worker = data_conf.get('n_worker', 0)
+
+        self.filenames = self._maybe_post_split(self._get_filenames())
+        random.seed(1)
+        random.shuffle(self.filenames)
+
+        self._data_conf = data_conf
+        self.traj_per_file = self.get_traj_per_file(self.filenames[0])
+        self.states, self.actions = self._load_states_actions()
+        self.T = self.states.shape[1]
+
+        print(phase)
+        print(len(self.filenames))
+
+    def _load_states_actions(self):
+        states, actions = [], []
+        for path in self.filenames:
+            with h5py.File(path, 'r') as F:
+                for ex_index in range(self.traj_per_file):
+                    key = 'traj{}'.format(ex_index)
+                    states.append(F[key + '/states'].value.astype(np.float32))
+                    actions.append(F[key + '/actions'].value.astype(np.float32))
+        return np.stack(states), np.stack(actions)
+
+    def get_data_loader(self, batch_size):
+        print('len {} dataset {}'.format(self.phase, len(self)))
+        sampler = RandomSampler(self) if self.shuffle else SequentialSampler(self)
+        return get_batched_data_loader(self, sampler, batch_size)
+
+    def __getitem__(self, index):
+        """
+        :param index: index of a trajectory or list of indices, which returns the stacked batch
+        """
+        inds = np.atleast_1d(index)
+        if self._data_conf.sel_len != -1:
+            # same crops as sample_rand_shifts, drawn for the whole batch at once
+            offsets = np.random.randint(0, self.T - self._data_conf.sel_len, len(inds))
+            t = offsets[:, None] + np.arange(self._data_conf.sel_len)
+            data_dict = AttrDict(states=self.states[inds[:, None], t], actions=self.actions[inds[:, None], t[:, :-1]])
+        else:
+            data_dict = AttrDict(states=self.states[inds], actions=self.actions[inds])
+
+        if np.ndim(index) == 0:
+            data_dict = map_dict(lambda x: x[0], data_dict)
+        return data_dict
+
+    def __len__(self):
+        return self.states.shape[0]
+
+
 if __name__ == '__main__':
     data_dir = os.environ['VMPC_DATA'] + '/classifier_control/data_collection/sim/1_obj_cartgripper_xz_rejsamp'
     hp = AttrDict(img_sz=(48, 64),
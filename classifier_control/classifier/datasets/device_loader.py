@@ -0,0 +1,102 @@
+""" Device-resident replacement of the DataLoader for datasets that fit into device memory. """
+import numpy as np
+import torch
+
+from classifier_control.classifier.datasets.data_loader import FixLenVideoDataset, LowDimDataset
+from classifier_control.classifier.datasets.frame_cache import preprocess_frames
+from classifier_control.classifier.models.utils.index_sampler import make_generator
+from classifier_control.classifier.utils.general_utils import AttrDict
+
+
+class DeviceDataLoader:
+    """
+    Loads a whole split of a FixLenVideoDataset once into device tensors, uint8 images and float32 states and
+    actions, and draws the minibatches and random shifts on the device with a torch generator. No worker processes
+    and no host-device copies are involved after the initial load. With torch < 1.5 the random draws are made on the
+    CPU and copied to the device, see make_generator.
+    Iterating gives one epoch with the semantics of the DataLoader of the dataset: shuffled for the train split,
+    in order otherwise, and the last incomplete batch is dropped.
+    """
+
+    @staticmethod
+    def check_data_conf(data_conf):
+        """ Raises a ValueError for data configurations the device loader cannot serve, before anything is built """
+        if data_conf.get('replay_store', False):
+            raise ValueError('device_dataset cannot be combined with replay_store, the store is sampled by transition')
+        if data_conf.get('sparse_frames', False):
+            raise ValueError('device_dataset cannot be combined with sparse_frames, every frame is on the device')
+
+    def __init__(self, dataset, batch_size, device, seed=None):
+        """
+
+        :param dataset: FixLenVideoDataset or LowDimDataset, sparse_frames is not supported
+        :param device: device the split is loaded to
+        :param seed: seed of the generator, if None it is drawn from the global torch RNG
+        """
+        if not isinstance(dataset, FixLenVideoDataset):
+            raise ValueError('the device loader needs a FixLenVideoDataset, got {}'.format(type(dataset).__name__))
+        if getattr(dataset, '_frame_sampler', None) is not None:
+            raise ValueError('sparse_frames is not supported by the device loader, every frame is on the device')
+        self.phase = dataset.phase
+        self.batch_size = batch_size
+        self.shuffle = dataset.shuffle
+        self.sel_len = dataset._data_conf.sel_len
+        self.device = torch.device(device)
+        if self.device.type == 'cuda' and self.device.index is None:
+            self.device = torch.device('cuda', torch.cuda.current_device())
+
+        if isinstance(dataset, LowDimDataset):
+            self.data = AttrDict(states=torch.from_numpy(dataset.states).to(self.device),
+                                 actions=torch.from_numpy(dataset.actions).to(self.device))
+        else:
+            self.data = self._load(dataset)
+        self.n_traj = self.data.states.shape[0]
+        # sequence length of the random shifts, as in FixLenVideoDataset.sample_rand_shifts
+        self.T = dataset.T
+        assert self.T <= self.data.states.shape[1], \
+            'T = {} exceeds the stored sequence length {}'.format(self.T, self.data.states.shape[1])
+        print('loaded {} trajectories of the {} split to {}'.format(self.n_traj, self.phase, self.device))
+
+        if seed is None:
+            seed = int(torch.randint(2**62, (1,)).item())
+        self._generator, self._generator_device = make_generator(self.device, seed)
+
+    def _load(self, dataset):
+        """ Copies the trajectories one by one into preallocated device tensors, the host never holds the split """
+        data = None
+        for index in range(len(dataset)):
+            traj = dataset.load_trajectory(index)
+            if 'images' in traj:
+                traj.demo_seq_images = preprocess_frames(traj.pop('images'), dataset.img_sz)
+            if data is None:
+                data = AttrDict({name: torch.empty((len(dataset),) + value.shape,
+                                                   dtype=torch.uint8 if value.dtype == np.uint8 else torch.float32,
+                                                   device=self.device) for name, value in traj.items()})
+            for name, value in traj.items():
+                data[name][index].copy_(torch.from_numpy(np.ascontiguousarray(value)))
+        return data
+
+    def __len__(self):
+        return self.n_traj // self.batch_size
+
+    def __iter__(self):
+        if self.shuffle:
+            order = torch.randperm(self.n_traj, generator=self._generator, device=self._generator_device)
+            order = order.to(self.device)
+        else:
+            order = torch.arange(self.n_traj, device=self.device)
+        for i in range(len(self)):
+            yield self._get_batch(order[i * self.batch_size:(i + 1) * self.batch_size])
+
+    def _get_batch(self, inds):
+        if self.sel_len == -1:
+            return AttrDict({name: value[inds] for name, value in self.data.items()})
+
+        # same crops as FixLenVideoDataset.sample_rand_shifts
+        offsets = torch.randint(self.T - self.sel_len, (inds.shape[0],), generator=self._generator,
+                                device=self._generator_device).to(self.device)
+        t = offsets[:, None] + torch.arange(self.sel_len, device=self.device)
+        batch = AttrDict({name: value[inds[:, None], t] for name, value in self.data.items()})
+        if 'actions' in batch:
+            batch.actions = batch.actions[:, :-1]
+        return batch
@@ -0,0 +1,94 @@
+""" Offline cache of resized, channel-first uint8 frames for FixLenVideoDataset.
+
+The cache for one split is a single memory-mapped .npy array of shape [n_traj, T, 3, height, width] stored in
+<data_dir>/frame_cache/, together with a text file listing the hdf5 files in row order.
+
+usage: python frame_cache.py <data_dir> --img_sz 64 64 --phases train val
+"""
+import argparse
+import glob
+import os
+
+import h5py
+import numpy as np
+
+from classifier_control.classifier.utils.general_utils import resize_video
+
+
+def get_cache_path(data_dir, phase, img_sz):
+    return os.path.join(data_dir, 'frame_cache', '{}_{}x{}.npy'.format(phase, img_sz[0], img_sz[1]))
+
+
+def _get_index_path(cache_path):
+    return cache_path.replace('.npy', '_files.txt')
+
+
+def preprocess_frames(images, img_sz):
+    """ Resizes a [T, (ncam,) H, W, 3] uint8 sequence and converts it to channel-first without changing the dtype """
+    if len(images.shape) == 5:
+        images = images[:, 0]  # Number of cameras, used in RL environments
+    assert images.dtype == np.uint8, 'image need to be uint8!'
+    images = resize_video(images, (img_sz[0], img_sz[1]))
+    return np.transpose(images, [0, 3, 1, 2])  # convert to channel-first
+
+
+def build_cache(data_dir, phase, img_sz):
+    """ Writes the frames of all trajectories in data_dir/hdf5/<phase> into one memory-mapped array. """
+    filenames = sorted(glob.glob(os.path.join(data_dir, 'hdf5', phase) + '/*'))
+    if not filenames:
+        raise RuntimeError('No filenames found in {}'.format(os.path.join(data_dir, 'hdf5', phase)))
+
+    with h5py.File(filenames[0], 'r') as F:
+        traj_per_file = F['traj_per_file'].value
+        T = F['traj0/images'].shape[0]
+
+    cache_path = get_cache_path(data_dir, phase, img_sz)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    frames = np.lib.format.open_memmap(cache_path, mode='w+', dtype=np.uint8,
+                                       shape=(len(filenames) * traj_per_file, T, 3, img_sz[0], img_sz[1]))
+    for i_file, path in enumerate(filenames):
+        with h5py.File(path, 'r') as F:
+            for ex_index in range(traj_per_file):
+                frames[i_file * traj_per_file + ex_index] = \
+                    preprocess_frames(F['traj{}/images'.format(ex_index)].value, img_sz)
+        print('cached {}/{} files'.format(i_file + 1, len(filenames)))
+    frames.flush()
+    del frames
+
+    with open(_get_index_path(cache_path), 'w') as f:
+        f.write('\n'.join(os.path.basename(path) for path in filenames))
+    return cache_path
+
+
+class FrameCache:
+    """ Read access to a cache written by build_cache, the array is mapped lazily so that every worker maps it itself """
+
+    def __init__(self, data_dir, phase, img_sz, traj_per_file):
+        self._cache_path = get_cache_path(data_dir, phase, img_sz)
+        if not os.path.exists(self._cache_path):
+            raise RuntimeError('No frame cache found at {}, run frame_cache.py first!'.format(self._cache_path))
+        with open(_get_index_path(self._cache_path)) as f:
+            self._file_rows = {name: i * traj_per_file for i, name in enumerate(f.read().split('\n'))}
+        self._frames = None
+
+    def get(self, path, ex_index):
+        if self._frames is None:
+            # copy-on-write mapping gives writable arrays without reading the file
+            self._frames = np.load(self._cache_path, mmap_mode='c')
+        return self._frames[self._file_rows[os.path.basename(path)] + ex_index]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_frames'] = None
+        return state
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data_dir', help='dataset directory containing hdf5/<phase>')
+    parser.add_argument('--img_sz', nargs=2, type=int, default=[64, 64])
+    parser.add_argument('--phases', nargs='+', default=['train', 'val'])
+    args = parser.parse_args()
+
+    for phase in args.phases:
+        print('written {}'.format(build_cache(args.data_dir, phase, args.img_sz)))
@@ -0,0 +1,79 @@
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import h5py
+
+
+class HDF5HandlePool:
+    """
+    LRU pool of open read-only HDF5 file handles.
+
+    Every DataLoader worker holds its own pool: handles opened before a fork are never reused in the child,
+    the pool detects the pid change and drops them without closing (closing would invalidate the parent's handles).
+    """
+
+    def __init__(self, max_size=8):
+        """
+
+        :param max_size: maximum number of simultaneously open files, 0 disables pooling
+        """
+        self.max_size = max_size
+        self._handles = OrderedDict()
+        self._pid = os.getpid()
+
+    def get(self, path):
+        """ Returns an open read-only handle for path, opening it if it is not in the pool. """
+        self._check_fork()
+        if path in self._handles:
+            self._handles.move_to_end(path)
+            return self._handles[path]
+
+        handle = h5py.File(path, 'r')
+        if self.max_size > 0:
+            self._handles[path] = handle
+            while len(self._handles) > self.max_size:
+                _, evicted = self._handles.popitem(last=False)
+                evicted.close()
+        return handle
+
+    @contextmanager
+    def open(self, path):
+        """ Context manager around get and release, the handle is released even if reading from it fails """
+        handle = self.get(path)
+        try:
+            yield handle
+        finally:
+            self.release(path, handle)
+
+    def release(self, path, handle):
+        """ Closes handles that are not owned by the pool, call after every get. """
+        if self._handles.get(path) is not handle:
+            handle.close()
+
+    def close(self):
+        self._check_fork()
+        for handle in self._handles.values():
+            handle.close()
+        self._handles.clear()
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            # handles were inherited from the parent process, h5py handles are not fork-safe
+            self._handles = OrderedDict()
+            self._pid = os.getpid()
+
+    def __len__(self):
+        return len(self._handles)
+
+    def __getstate__(self):
+        # handles cannot be pickled (e.g. for spawned workers), the new process reopens lazily
+        state = self.__dict__.copy()
+        state['_handles'] = OrderedDict()
+        return state
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -0,0 +1,200 @@
+""" Flat, memory-mapped transition store for Q-function training.
+
+The store of one split is a directory <data_dir>/replay_store/<phase>_<height>x<width> (<phase>_states without
+images) holding the frames of all trajectories back to back:
+    observations.npy  [n_frames, 3, height, width] uint8, resized and channel-first
+    states.npy        [n_frames, state_dim] float32
+    actions.npy       [n_frames, action_dim] float32, the action taken at every frame, zero after the last action
+    traj_starts.npy   [n_traj + 1] int64, the first frame of every trajectory and the total number of frames
+
+usage: python replay_store.py <data_dir> --img_sz 64 64 --phases train val [--state_only]
+"""
+import argparse
+import glob
+import os
+
+import h5py
+import numpy as np
+from torch.utils.data import SequentialSampler
+
+from classifier_control.classifier.datasets.data_loader import BaseVideoDataset, get_batched_data_loader
+from classifier_control.classifier.datasets.frame_cache import preprocess_frames
+from classifier_control.classifier.models.utils.index_sampler import TripletFrameSampler
+from classifier_control.classifier.utils.general_utils import AttrDict
+
+
+def get_store_dir(data_dir, phase, img_sz, state_only=False):
+    name = '{}_states'.format(phase) if state_only else '{}_{}x{}'.format(phase, img_sz[0], img_sz[1])
+    return os.path.join(data_dir, 'replay_store', name)
+
+
+def build_store(data_dir, phase, img_sz, state_only=False):
+    """ Writes all trajectories in data_dir/hdf5/<phase> into the flat arrays of a replay store """
+    filenames = sorted(glob.glob(os.path.join(data_dir, 'hdf5', phase) + '/*'))
+    if not filenames:
+        raise RuntimeError('No filenames found in {}'.format(os.path.join(data_dir, 'hdf5', phase)))
+
+    # first pass over the shapes only, to size the arrays
+    traj_lens = []
+    for path in filenames:
+        with h5py.File(path, 'r') as F:
+            for ex_index in range(F['traj_per_file'].value):
+                traj_lens.append(F['traj{}/states'.format(ex_index)].shape[0])
+            state_dim = F['traj0/states'].shape[1]
+            action_dim = F['traj0/actions'].shape[1]
+    traj_starts = np.concatenate([[0], np.cumsum(traj_lens)]).astype(np.int64)
+    n_frames = int(traj_starts[-1])
+
+    store_dir = get_store_dir(data_dir, phase, img_sz, state_only)
+    os.makedirs(store_dir, exist_ok=True)
+    arrays = AttrDict(
+        states=np.lib.format.open_memmap(os.path.join(store_dir, 'states.npy'), mode='w+', dtype=np.float32,
+                                         shape=(n_frames, state_dim)),
+        actions=np.lib.format.open_memmap(os.path.join(store_dir, 'actions.npy'), mode='w+', dtype=np.float32,
+                                          shape=(n_frames, action_dim)))
+    if not state_only:
+        arrays.observations = np.lib.format.open_memmap(os.path.join(store_dir, 'observations.npy'), mode='w+',
+                                                        dtype=np.uint8, shape=(n_frames, 3, img_sz[0], img_sz[1]))
+
+    i_traj = 0
+    for i_file, path in enumerate(filenames):
+        with h5py.File(path, 'r') as F:
+            for ex_index in range(F['traj_per_file'].value):
+                key = 'traj{}'.format(ex_index)
+                start, end = traj_starts[i_traj], traj_starts[i_traj + 1]
+                arrays.states[start:end] = F[key + '/states'].value
+                actions = F[key + '/actions'].value[:end - start]
+                arrays.actions[start:start + actions.shape[0]] = actions
+                arrays.actions[start + actions.shape[0]:end] = 0
+                if not state_only:
+                    arrays.observations[start:end] = preprocess_frames(F[key + '/images'].value, img_sz)
+                i_traj += 1
+        print('stored {}/{} files'.format(i_file + 1, len(filenames)))
+    for array in arrays.values():
+        array.flush()
+    del arrays
+
+    np.save(os.path.join(store_dir, 'traj_starts.npy'), traj_starts)
+    return store_dir
+
+
+class ReplayStore:
+    """
+    Read access to a store written by build_store. Transitions are drawn uniformly over all valid t0 of all
+    trajectories, and only the rows of the sampled frames are gathered from the flat arrays, so sampling costs O(1) per
+    transition independent of the trajectory length. The arrays are mapped lazily so that every worker maps them itself.
+    """
+
+    def __init__(self, store_dir, tdist=1, load_observations=True):
+        """
+
+        :param tdist: temporal distance of the positives, as in TimeIndexSampler.sample_triplets
+        :param load_observations: if False only states and actions are served
+        """
+        if not os.path.exists(os.path.join(store_dir, 'traj_starts.npy')):
+            raise RuntimeError('No replay store found at {}, run replay_store.py first!'.format(store_dir))
+        self._store_dir = store_dir
+        self.tdist = tdist
+        self.load_observations = load_observations
+        self.traj_starts = np.load(os.path.join(store_dir, 'traj_starts.npy'))
+        self.n_traj = self.traj_starts.shape[0] - 1
+        traj_lens = np.diff(self.traj_starts)
+
+        # index of valid transitions: t0 < tlen - tdist - 1 leaves room for a negative goal after t0 + tdist
+        n_valid = np.maximum(traj_lens - tdist - 1, 0)
+        self.valid_traj = np.repeat(np.arange(self.n_traj), n_valid)
+        first_valid = np.cumsum(n_valid) - n_valid
+        self.valid_t0 = np.arange(self.valid_traj.shape[0]) - np.repeat(first_valid, n_valid)
+        self._n_valid = n_valid
+        self._arrays = None
+
+    def __len__(self):
+        """ number of valid transitions """
+        return self.valid_t0.shape[0]
+
+    def _get_arrays(self):
+        if self._arrays is None:
+            names = ['states', 'actions'] + (['observations'] if self.load_observations else [])
+            self._arrays = AttrDict({name: np.load(os.path.join(self._store_dir, name + '.npy'), mmap_mode='r')
+                                     for name in names})
+        return self._arrays
+
+    def sample(self, batch_size, rng=np.random):
+        """
+        Samples positive and negative triplets, as TripletFrameSampler, for transitions drawn uniformly over the store
+        :return: AttrDict in the sparse-frame format, with the states and actions in slot order as well:
+        demo_seq_images batch x 6 x 3 x height x width uint8 (if loaded), states and actions batch x 6 x dim at the
+        frames of the slots, and frame_inds batch x 6 holding the slot of every frame, 0 ... 5, which the models use to
+        index the slot-ordered states and actions
+        """
+        arrays = self._get_arrays()
+        i = rng.randint(0, len(self), batch_size)
+        traj = self.valid_traj[i]
+        start, end = self.traj_starts[traj], self.traj_starts[traj + 1]
+
+        t0 = self.valid_t0[i]
+        tg = t0 + 1 + rng.randint(0, self.tdist, batch_size)
+        # negatives come from the same trajectory, their goal is uniform in [neg_t0 + tdist + 1, tlen)
+        neg_t0 = (rng.random_sample(batch_size) * self._n_valid[traj]).astype(np.int64)
+        neg_t0 = np.minimum(neg_t0, self._n_valid[traj] - 1)
+        low = neg_t0 + self.tdist + 1
+        neg_tg = np.minimum(low + (rng.random_sample(batch_size) * (end - start - low)).astype(np.int64),
+                            end - start - 1)
+        rows = start[:, None] + np.stack([t0, t0 + 1, tg, neg_t0, neg_t0 + 1, neg_tg], axis=1)
+
+        batch = AttrDict(states=arrays.states[rows], actions=arrays.actions[rows],
+                         frame_inds=np.tile(np.arange(rows.shape[1]), (batch_size, 1)))
+        if self.load_observations:
+            batch.demo_seq_images = arrays.observations[rows]
+        return batch
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+
+class ReplayDataset(BaseVideoDataset):
+    """
+    Serves batches of a ReplayStore for the Q-functions, in the sparse-frame format of TripletFrameSampler.
+    An epoch has as many batches as the trajectory datasets, n_traj // batch_size, but every batch is drawn
+    uniformly over the transitions of the store. Training batches use the numpy RNG of the worker, the batches of the
+    other phases are seeded with their position in the epoch and are the same in every epoch.
+    With data_conf.state_only the images are not served.
+    """
+
+    def __init__(self, data_dir, mpar, data_conf, phase='train', shuffle=True, frame_sampler=None):
+        super().__init__(data_dir, mpar, data_conf, phase, shuffle)
+        if not isinstance(frame_sampler, TripletFrameSampler):
+            raise ValueError('the replay store serves the triplets of the Q-functions, got {}'.format(frame_sampler))
+        state_only = data_conf.get('state_only', False)
+        self.store = ReplayStore(get_store_dir(data_dir, phase, self.img_sz, state_only), frame_sampler.tdist,
+                                 load_observations=not state_only)
+        print(phase)
+        print('{} transitions in {} trajectories'.format(len(self.store), self.store.n_traj))
+
+    def get_data_loader(self, batch_size):
+        print('len {} dataset {}'.format(self.phase, len(self)))
+        # the index batches only set the size of the batches, see __getitem__
+        return get_batched_data_loader(self, SequentialSampler(self), batch_size)
+
+    def __getitem__(self, index):
+        if self.phase == 'train':
+            return self.store.sample(len(index))
+        # fixed batches for the other phases, so that the validation loss is comparable between epochs
+        return self.store.sample(len(index), np.random.RandomState(index[0]))
+
+    def __len__(self):
+        return self.store.n_traj
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data_dir', help='dataset directory containing hdf5/<phase>')
+    parser.add_argument('--img_sz', nargs=2, type=int, default=[64, 64])
+    parser.add_argument('--phases', nargs='+', default=['train', 'val'])
+    parser.add_argument('--state_only', action='store_true', help='only store states and actions')
+    args = parser.parse_args()
+
+    for phase in args.phases:
+        print('written {}'.format(build_store(args.data_dir, phase, args.img_sz, args.state_only)))
@@ -36,7 +36,9 @@ class BaseModel(nn.Module):
             'device':None,
             'data_conf':None,
             'img_sz': None,
-            'goal_cond':True
+            'goal_cond':True,
+            'sampler_seed': None,  # seed for sampling training time indices, if None drawn from the torch RNG
+            'max_batch_size': -1,  # largest batch evaluated in one call at test time, -1 for no limit
         })
         
         # Network params
@@ -58,6 +60,37 @@ class BaseModel(nn.Module):
             self._hp.use_convs, self._hp.use_batchnorm, self._hp.normalization))
         self._hp.img_sz = self._hp.data_conf['img_sz']
 
+    def score(self, current_img, goal_img):
+        """
+        Tensor-only cost of reaching goal_img from current_img, used by the test-time models and for tracing
+        :param current_img: batch x channel x height x width
+        :param goal_img: batch x channel x height x width
+        :return: costs with shape batch
+        """
+        raise NotImplementedError("Need to implement this function in the subclass!")
+
+    def set_goal(self, goal_img):
+        """
+        Caches the goal image of the test-time cost, inputs without 'goal_img' are then compared to this goal
+        :param goal_img: 1 x channel x height x width
+        """
+        self._goal_img = goal_img
+
+    def _add_goal(self, inputs):
+        """ Adds the cached goal image, broadcast to the batch size, to inputs that do not contain a goal image """
+        if 'goal_img' in inputs:
+            return inputs
+        inputs = AttrDict(inputs)
+        inputs['goal_img'] = self._goal_img.expand((inputs['current_img'].shape[0],) + self._goal_img.shape[1:])
+        return inputs
+
+    def get_frame_sampler(self):
+        """
+        FrameSampler drawing the frames the model uses per training trajectory, required for data_conf.sparse_frames.
+        In that mode demo_seq_images only holds these frames and inputs.frame_inds their time indices.
+        """
+        raise NotImplementedError("{} does not support sparse frames".format(type(self).__name__))
+
     def build_network(self):
         raise NotImplementedError("Need to implement this function in the subclass!")
 
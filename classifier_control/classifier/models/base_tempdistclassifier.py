@@ -4,9 +4,12 @@ import torch
 from visual_mpc.policy.cem_controllers.visualizer.construct_html import save_imgs_direct
 from classifier_control.classifier.utils.general_utils import AttrDict
 import torch.nn as nn
+import torch.nn.functional as F
 from classifier_control.classifier.models.base_model import BaseModel
 from classifier_control.classifier.models.single_tempdistclassifier import SingleTempDistClassifier
 from classifier_control.classifier.models.single_tempdistclassifier import TesttimeSingleTempDistClassifier
+from classifier_control.classifier.models.stacked_tempdistclassifier import StackedTempDistClassifier, stack_state_dict
+from classifier_control.classifier.models.utils.index_sampler import PairFrameSampler
 from classifier_control.classifier.utils.vis_utils import visualize_barplot_array
 import os
 import yaml
@@ -38,7 +41,8 @@ class BaseTempDistClassifier(BaseModel):
             'use_skips':False, #todo try resnet architecture!
             'ngf': 8,
             'nz_enc': 64,
-            'classifier_restore_path':None  # not really needed here.
+            'classifier_restore_path':None,  # not really needed here.
+            'stacked_ensemble': False,  # evaluate all classifiers in one pass with grouped convolutions
         })
 
         # add new params to parent params
@@ -52,6 +56,9 @@ class BaseTempDistClassifier(BaseModel):
         return SingleTempDistClassifier
 
     def build_network(self, build_encoder=True):
+        if self._hp.stacked_ensemble:
+            self.stacked_classifier = StackedTempDistClassifier(self._hp, self._logger)
+            return
         for i in range(self._hp.ndist_max):
             tdist = i + 1
             self.tdist_classifiers.append(self.singletempdistclassifier(self._hp, tdist, self._logger))
@@ -64,15 +71,23 @@ class BaseTempDistClassifier(BaseModel):
             images shape = batch x time x channel x height x width
         :return: model_output
         """
+        if self._hp.stacked_ensemble:
+            return self.stacked_classifier(inputs)
         model_output = []
         for c in self.tdist_classifiers:
             model_output.append(c(inputs))
         return model_output
 
+    def get_frame_sampler(self):
+        return PairFrameSampler([i + 1 for i in range(self._hp.ndist_max)])
+
     def loss(self, model_output):
-        losses = AttrDict()
-        for i_cl, cl in enumerate(self.tdist_classifiers):
-            setattr(losses, 'tdist{}'.format(cl.tdist), cl.loss(model_output[i_cl]))
+        if self._hp.stacked_ensemble:
+            losses = self.stacked_classifier.loss(model_output)
+        else:
+            losses = AttrDict()
+            for i_cl, cl in enumerate(self.tdist_classifiers):
+                setattr(losses, 'tdist{}'.format(cl.tdist), cl.loss(model_output[i_cl]))
 
         # compute total loss
         losses.total_loss = torch.stack(list(losses.values())).sum()
@@ -81,13 +96,20 @@ class BaseTempDistClassifier(BaseModel):
     def get_device(self):
         return self._hp.device
 
+    def convert_state_dict(self, state_dict):
+        """ Converts checkpoints of the sequential classifiers if the model uses the stacked ensemble """
+        if self._hp.stacked_ensemble and 'stacked_classifier.' not in ''.join(state_dict.keys()):
+            return stack_state_dict(state_dict, self.stacked_classifier, self._hp.ndist_max,
+                                    src_prefix='tdist_classifiers.', tgt_prefix='stacked_classifier.')
+        return state_dict
+
 
 class BaseTempDistClassifierTestTime(BaseTempDistClassifier):
     def __init__(self, overrideparams, logger=None):
         super(BaseTempDistClassifierTestTime, self).__init__(overrideparams, logger)
         if self._hp.classifier_restore_path is not None:
             checkpoint = torch.load(self._hp.classifier_restore_path, map_location=self._hp.device)
-            self.load_state_dict(checkpoint['state_dict'])
+            self.load_state_dict(self.convert_state_dict(checkpoint['state_dict']))
         else:
             print('#########################')
             print("Warning Classifier weights not restored during init!!")
@@ -101,17 +123,14 @@ class BaseTempDistClassifierTestTime(BaseTempDistClassifier):
 
     def forward(self, inputs):
 #         self.gen_pairs()
-        outputs = super().forward(inputs)
+        inputs = self._add_goal(inputs)
+        return self.score(inputs['current_img'], inputs['goal_img'])
 
-        sigmoid = []
-        for i in range(self._hp.ndist_max):
-            sigmoid.append(outputs[i].out_sigmoid.data.cpu().numpy().squeeze())
-        self.sigmoids = np.stack(sigmoid, axis=1)
-        sigmoids_shifted = np.concatenate((np.zeros([self._hp.batch_size, 1]), self.sigmoids[:, :-1]), axis=1)
-        differences = self.sigmoids - sigmoids_shifted
-        self.softmax_differences = softmax(differences, axis=1)
-        expected_dist = np.sum((1 + np.arange(self.softmax_differences.shape[1])[None]) * self.softmax_differences, 1)
+    def score(self, current_img, goal_img):
+        outputs = super().forward(AttrDict(current_img=current_img, goal_img=goal_img))
 
+        self.sigmoids = torch.stack([outputs[i].out_sigmoid.view(-1) for i in range(self._hp.ndist_max)], dim=1)
+        expected_dist, self.softmax_differences = expected_distance(self.sigmoids)
         return expected_dist
 
     def gen_pairs(self):
@@ -189,13 +208,13 @@ class BaseTempDistClassifierTestTime(BaseTempDistClassifier):
 
     def visualize_test_time(self, content_dict, visualize_indices, verbose_folder):
         # save classifier preds
-        sel_sigmoids = self.sigmoids[visualize_indices]
+        sel_sigmoids = self.sigmoids.data.cpu().numpy()[visualize_indices]
         sigmoid_images = visualize_barplot_array(sel_sigmoids)
         row_name = 'sigmoid_images'
         content_dict[row_name] = save_imgs_direct(verbose_folder,
                                                   row_name, sigmoid_images)
 
-        sel_softmax_dists = self.softmax_differences[visualize_indices]
+        sel_softmax_dists = self.softmax_differences.data.cpu().numpy()[visualize_indices]
         sigmoid_images = visualize_barplot_array(sel_softmax_dists)
         row_name = 'softmax_of_differences'
         content_dict[row_name] = save_imgs_direct(verbose_folder,
@@ -232,6 +251,19 @@ class BaseTempDistClassifierTestTime(BaseTempDistClassifier):
 
         print('logged dist over traj')
 
+def expected_distance(sigmoids):
+    """
+    Expected temporal distance from the outputs of the per-distance classifiers, computed on the device of sigmoids
+    :param sigmoids: batch x ndist_max, probabilities that the goal is reached within 1 ... ndist_max steps
+    :return: expected distances (batch), softmax of the differences between neighbouring sigmoids (batch x ndist_max)
+    """
+    differences = sigmoids - F.pad(sigmoids[:, :-1], [1, 0])
+    exp = torch.exp(differences)
+    softmax_differences = exp / (exp.sum(1, keepdim=True) + 1e-5)
+    # 1 ... ndist_max built from sigmoids, a device argument would be hard-coded into traced scores
+    support = torch.cumsum(torch.ones_like(sigmoids[0]), 0)
+    return torch.sum(support[None] * softmax_differences, 1), softmax_differences
+
 def softmax(array, axis=0):
     exp = np.exp(array)
     exp = exp/(np.sum(exp, axis=axis)[:, None] + 1e-5)
@@ -8,6 +8,8 @@ import torch.nn.functional as F
 
 import cv2
 from classifier_control.classifier.models.base_model import BaseModel
+from classifier_control.classifier.models.utils.utils import select_indices
+from classifier_control.classifier.models.utils.index_sampler import TimeIndexSampler, TripletFrameSampler
 from classifier_control.classifier.utils.vae import VAE
 
 class LatentSpace(BaseModel):
@@ -21,6 +23,7 @@ class LatentSpace(BaseModel):
         assert self._hp.batch_size != -1   # make sure that batch size was overridden
 
         self.tdist_classifiers = []
+        self._index_sampler = TimeIndexSampler(self._hp.sampler_seed)
         self.build_network()
         self._use_pred_length = False
         
@@ -58,7 +61,8 @@ class LatentSpace(BaseModel):
         self.mu, self.logvar, _, self.rec = self.vae(self.images.view(-1, 3, 64, 64))
         self.rec = self.rec.view(-1,tlen, 3, 64, 64)
       
-        pos_pairs, neg_pairs, pos_act, neg_act = self.sample_image_triplet_actions(inputs.demo_seq_images, inputs.actions, tlen, 1, inputs.states[:, :,  :2])
+        pos_pairs, neg_pairs, pos_act, neg_act = self.sample_image_triplet_actions(inputs.demo_seq_images, inputs.actions, tlen, 1, inputs.states[:, :,  :2],
+                                                                                   frame_inds=inputs.get('frame_inds'))
         
         ims = torch.cat([pos_pairs, neg_pairs], dim=0) 
         _, _, curr_z, _ = self.vae(ims[:, :3, :, :])
@@ -68,17 +72,26 @@ class LatentSpace(BaseModel):
         return dist
         
     
-    def sample_image_triplet_actions(self, images, actions, tlen, tdist, states):
-        
+    def get_frame_sampler(self):
+        return TripletFrameSampler(tdist=1)
+
+    def sample_image_triplet_actions(self, images, actions, tlen, tdist, states, frame_inds=None):
+        """
+        :param frame_inds: time indices of the frames in images if they are the sparse frames of get_frame_sampler
+        """
+        if frame_inds is None:
+            pos_inds, neg_inds = self._index_sampler.sample_triplets(self._hp.batch_size, tlen, tdist, images.device)
+            pos_slots, neg_slots = pos_inds, neg_inds
+        else:
+            pos_inds, neg_inds, pos_slots, neg_slots = TripletFrameSampler.split(frame_inds)
+
         # get positives:
-        t0 = np.random.randint(0, tlen - tdist - 1, self._hp.batch_size)
-        t1 = t0 + 1
-        tg = t0 + 1 + np.random.randint(0, tdist, self._hp.batch_size)
-        t0, t1,  tg = torch.from_numpy(t0), torch.from_numpy(t1), torch.from_numpy(tg)
-
-        im_t0 = select_indices(images, t0)
-        im_t1 = select_indices(images, t1)
-        im_tg = select_indices(images, tg)
+        t0, t1, tg = pos_inds
+        s0, s1, sg = pos_slots
+
+        im_t0 = select_indices(images, s0)
+        im_t1 = select_indices(images, s1)
+        im_tg = select_indices(images, sg)
         s_t0 = select_indices(states, t0)
         s_t1 = select_indices(states, t1)
         s_tg = select_indices(states, tg)
@@ -88,15 +101,12 @@ class LatentSpace(BaseModel):
         self.pos_pair_cat = torch.cat([im_t0, im_t1, im_tg], dim=1)
 
         # get negatives:
-        t0 = np.random.randint(0, tlen - tdist - 1, self._hp.batch_size)
-        t1 = t0 + 1
-        tg = [np.random.randint(t0[b] + tdist + 1, tlen, 1) for b in range(self._hp.batch_size)]
-        tg = np.array(tg).squeeze()
-        t0, t1, tg = torch.from_numpy(t0), torch.from_numpy(t1), torch.from_numpy(tg)
-
-        im_t0 = select_indices(images, t0)
-        im_t1 = select_indices(images, t1)
-        im_tg = select_indices(images, tg)
+        t0, t1, tg = neg_inds
+        s0, s1, sg = neg_slots
+
+        im_t0 = select_indices(images, s0)
+        im_t1 = select_indices(images, s1)
+        im_tg = select_indices(images, sg)
         s_t0 = select_indices(states, t0)
         s_t1 = select_indices(states, t1)
         s_tg = select_indices(states, tg)
@@ -105,7 +115,8 @@ class LatentSpace(BaseModel):
         self.neg_pair_cat = torch.cat([im_t0, im_t1, im_tg], dim=1)
 
         # one means within range of tdist range,  zero means outside of tdist range
-        self.labels = torch.cat([torch.ones(self._hp.batch_size), torch.zeros(self._hp.batch_size)])
+        self.labels = torch.cat([torch.ones(self._hp.batch_size, device=images.device),
+                                 torch.zeros(self._hp.batch_size, device=images.device)])
 
         return self.pos_pair_cat, self.neg_pair_cat, pos_act, neg_act
 
@@ -164,18 +175,8 @@ class LatentSpace(BaseModel):
 
     def get_device(self):
         return self._hp.device
-    
-    
 
 
-    
-def select_indices(tensor, indices):
-    new_images = []
-    for b in range(tensor.shape[0]):
-        new_images.append(tensor[b, indices[b]])
-    tensor = torch.stack(new_images, dim=0)
-    return tensor
-
 class LatentSpaceTestTime(LatentSpace):
     def __init__(self, overrideparams, logger=None):
         super(LatentSpaceTestTime, self).__init__(overrideparams, logger)
@@ -190,9 +191,21 @@ class LatentSpaceTestTime(LatentSpace):
       
     def visualize_test_time(self, content_dict, visualize_indices, verbose_folder):
         pass
+
+    def set_goal(self, goal_img):
+      super().set_goal(goal_img)
+      # the goal latent is computed once and broadcast against the latents of all current images
+      with torch.no_grad():
+        self._goal_z = self.vae.encode_mean(goal_img)
       
     def forward(self, inputs):
-      _, _, curr_z, _ = self.vae(inputs['current_img'])
-      _, _, goal_z, _ = self.vae(inputs['goal_img'])
-      dist = ((curr_z - goal_z)**2).mean(1)
-      return dist.detach().cpu().numpy()
+      if 'goal_img' in inputs:
+        return self.score(inputs['current_img'], inputs['goal_img'])
+      curr_z = self.vae.encode_mean(inputs['current_img'])
+      return ((curr_z - self._goal_z)**2).mean(1)
+
+    def score(self, current_img, goal_img):
+      # the distance only needs the mean latents, sampling and decoding are skipped
+      curr_z = self.vae.encode_mean(current_img)
+      goal_z = self.vae.encode_mean(goal_img)
+      return ((curr_z - goal_z)**2).mean(1)
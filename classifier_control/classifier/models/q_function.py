@@ -7,7 +7,10 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from classifier_control.classifier.models.base_model import BaseModel
-from classifier_control.classifier.utils.q_network import QNetwork
+from classifier_control.classifier.models.utils.utils import select_indices
+from classifier_control.classifier.models.utils.index_sampler import TimeIndexSampler, TripletFrameSampler
+from classifier_control.classifier.models.utils.target_network import TargetNetworkUpdater
+from classifier_control.classifier.utils.q_network import QNetwork, evaluate_sampled_actions
 
 class QFunction(BaseModel):
     def __init__(self, overrideparams, logger=None):
@@ -20,6 +23,7 @@ class QFunction(BaseModel):
         assert self._hp.batch_size != -1   # make sure that batch size was overridden
 
         self.tdist_classifiers = []
+        self._index_sampler = TimeIndexSampler(self._hp.sampler_seed)
         self.build_network()
         self._use_pred_length = False
         
@@ -32,8 +36,11 @@ class QFunction(BaseModel):
             'nz_enc': 64,
             'classifier_restore_path':None,  # not really needed here.,
             'low_dim':False,
-            'gamma':0.0
-            
+            'gamma':0.0,
+            'n_action_samples': 100,  # number of random actions used to approximate the max over actions
+            'action_sample_chunk': None,  # max number of action samples evaluated per batch, None for all at once
+            'target_update_tau': 1.0,  # Polyak coefficient of the target network update, 1.0 copies the weights
+            'target_update_interval': 1,  # number of training steps between target network updates
         })
 
         # add new params to parent params
@@ -46,6 +53,8 @@ class QFunction(BaseModel):
         self.qnetwork = QNetwork(self._hp)
         with torch.no_grad():
             self.target_qnetwork = QNetwork(self._hp)
+        self.target_updater = TargetNetworkUpdater(self.qnetwork, self.target_qnetwork,
+                                                   self._hp.target_update_tau, self._hp.target_update_interval)
 
     def forward(self, inputs):
         """
@@ -55,9 +64,10 @@ class QFunction(BaseModel):
         :return: model_output
         """
         #### Train vs Test
-        if "demo_seq_images" in inputs.keys():
-          tlen = inputs.demo_seq_images.shape[1]
-          pos_pairs, neg_pairs, pos_act, neg_act = self.sample_image_triplet_actions(inputs.demo_seq_images, inputs.actions, tlen, 1, inputs.states[:, :,  :2])
+        if "states" in inputs.keys():    # training batches, the state-only batches of LowDimDataset have no images
+          tlen = inputs.states.shape[1]
+          pos_pairs, neg_pairs, pos_act, neg_act = self.sample_image_triplet_actions(inputs.get('demo_seq_images'), inputs.actions, tlen, 1, inputs.states[:, :,  :2],
+                                                                                     frame_inds=inputs.get('frame_inds'))
           self.images = torch.cat([pos_pairs, neg_pairs], dim=0) 
           if self._hp.low_dim:
               image_0 = self.images[:, :2]
@@ -72,64 +82,78 @@ class QFunction(BaseModel):
 
           qval = self.qnetwork(image_pairs, acts)
         else:
-          qs = []
           image_pairs = torch.cat([inputs["current_img"], inputs["goal_img"]], dim=1)
-          for ns in range(100):
-              actions = torch.FloatTensor(image_pairs.size(0), self._hp.action_size).uniform_(-1, 1).cuda()
-              targetq = self.target_qnetwork(image_pairs, actions)
-              qs.append(targetq)
-          qs = torch.stack(qs)
+          qs = self.sample_target_qs(image_pairs)
           qval = torch.max(qs, 0)[0].squeeze()
           qval = qval.detach().cpu().numpy()
         return qval
     
-    def sample_image_triplet_actions(self, images, actions, tlen, tdist, states):
-        
+    def sample_target_qs(self, image_pairs):
+        """
+        Evaluates the target network for n_action_samples uniformly sampled actions, the image pairs are encoded once
+        :return: target network outputs with shape n_action_samples x batch x ...
+        """
+        # rand_like instead of a device argument, so that traced scores do not hard-code the export device
+        template = image_pairs.reshape(image_pairs.size(0), -1)[:, :1]
+        actions = torch.rand_like(template.expand(self._hp.n_action_samples, -1, self._hp.action_size)) * 2 - 1
+        return evaluate_sampled_actions(self.target_qnetwork, image_pairs, actions, self._hp.action_sample_chunk)
+
+    def get_frame_sampler(self):
+        return TripletFrameSampler(tdist=1)
+
+    def sample_image_triplet_actions(self, images, actions, tlen, tdist, states, frame_inds=None):
+        """
+        :param images: None for state-only batches, which requires low_dim
+        :param frame_inds: time indices of the frames in images if they are the sparse frames of get_frame_sampler
+        """
+        assert images is not None or self._hp.low_dim, "training on images requires demo_seq_images"
+        if frame_inds is None:
+            pos_inds, neg_inds = self._index_sampler.sample_triplets(self._hp.batch_size, tlen, tdist, states.device)
+            pos_slots, neg_slots = pos_inds, neg_inds
+        else:
+            pos_inds, neg_inds, pos_slots, neg_slots = TripletFrameSampler.split(frame_inds)
+
         # get positives:
-        t0 = np.random.randint(0, tlen - tdist - 1, self._hp.batch_size)
-        t1 = t0 + 1
-        tg = t0 + 1 + np.random.randint(0, tdist, self._hp.batch_size)
-        t0, t1,  tg = torch.from_numpy(t0), torch.from_numpy(t1), torch.from_numpy(tg)
-
-        im_t0 = select_indices(images, t0)
-        im_t1 = select_indices(images, t1)
-        im_tg = select_indices(images, tg)
+        t0, t1, tg = pos_inds
+
+        im_t0, im_t1, im_tg = self._select_frames(images, pos_slots)
         s_t0 = select_indices(states, t0)
         s_t1 = select_indices(states, t1)
         s_tg = select_indices(states, tg)
         pos_act = select_indices(actions, t0)
 
-        self.pos_pair = torch.stack([im_t0, im_tg], dim=1)
+        self.pos_pair = None if images is None else torch.stack([im_t0, im_tg], dim=1)
         if self._hp.low_dim:
             self.pos_pair_cat = torch.cat([s_t0, s_t1, s_tg], dim=1)
         else:
             self.pos_pair_cat = torch.cat([im_t0, im_t1, im_tg], dim=1)
 
         # get negatives:
-        t0 = np.random.randint(0, tlen - tdist - 1, self._hp.batch_size)
-        t1 = t0 + 1
-        tg = [np.random.randint(t0[b] + tdist + 1, tlen, 1) for b in range(self._hp.batch_size)]
-        tg = np.array(tg).squeeze()
-        t0, t1, tg = torch.from_numpy(t0), torch.from_numpy(t1), torch.from_numpy(tg)
-
-        im_t0 = select_indices(images, t0)
-        im_t1 = select_indices(images, t1)
-        im_tg = select_indices(images, tg)
+        t0, t1, tg = neg_inds
+
+        im_t0, im_t1, im_tg = self._select_frames(images, neg_slots)
         s_t0 = select_indices(states, t0)
         s_t1 = select_indices(states, t1)
         s_tg = select_indices(states, tg)
         neg_act = select_indices(actions, t0)
-        self.neg_pair = torch.stack([im_t0, im_tg], dim=1)
+        self.neg_pair = None if images is None else torch.stack([im_t0, im_tg], dim=1)
         if self._hp.low_dim:
             self.neg_pair_cat = torch.cat([s_t0, s_t1, s_tg], dim=1)
         else:
             self.neg_pair_cat = torch.cat([im_t0, im_t1, im_tg], dim=1)
 
         # one means within range of tdist range,  zero means outside of tdist range
-        self.labels = torch.cat([torch.ones(self._hp.batch_size), torch.zeros(self._hp.batch_size)])
+        self.labels = torch.cat([torch.ones(self._hp.batch_size, device=states.device),
+                                 torch.zeros(self._hp.batch_size, device=states.device)])
 
         return self.pos_pair_cat, self.neg_pair_cat, pos_act, neg_act
 
+    @staticmethod
+    def _select_frames(images, slots):
+        if images is None:
+            return None, None, None
+        return [select_indices(images, slot) for slot in slots]
+
 
     def loss(self, model_output):
         if self._hp.low_dim:
@@ -137,19 +161,16 @@ class QFunction(BaseModel):
         else:
             image_pairs = self.images[:, 3:]
             
-        qs = []
-        for ns in range(100):
-            actions = torch.FloatTensor(model_output.size(0), self._hp.action_size).uniform_(-1, 1).cuda()
-            targetq = self.target_qnetwork(image_pairs, actions)
-            qs.append(targetq)
-        qs = torch.stack(qs)
+        with torch.no_grad():
+            qs = self.sample_target_qs(image_pairs)
         lb = self.labels.to(self._hp.device)
         
         losses = AttrDict()
         target = lb + self._hp.gamma * torch.max(qs, 0)[0].squeeze()
         losses.total_loss = F.mse_loss(target, model_output.squeeze()) 
         
-        self.target_qnetwork.load_state_dict(self.qnetwork.state_dict())
+        if self.training:
+            self.target_updater.update()
         return losses
     
     def _log_outputs(self, model_output, inputs, losses, step, log_images, phase):
@@ -181,7 +202,7 @@ class QFunction(BaseModel):
 #         qvals -= qvals.min()
 #         qvals /= qvals.max()
         
-        if log_images:
+        if log_images and self.pos_pair is not None:
             self._logger.log_single_tdist_classifier_image(self.pos_pair, self.neg_pair, model_output.squeeze(),
                                                           'tdist{}'.format("Q"), step, phase)
 #             self._logger.log_heatmap_image(self.pos_pair, qvals, model_output.squeeze(),
@@ -189,17 +210,7 @@ class QFunction(BaseModel):
 
     def get_device(self):
         return self._hp.device
-    
-    
-
 
-    
-def select_indices(tensor, indices):
-    new_images = []
-    for b in range(tensor.shape[0]):
-        new_images.append(tensor[b, indices[b]])
-    tensor = torch.stack(new_images, dim=0)
-    return tensor
 
 class QFunctionTestTime(QFunction):
     def __init__(self, overrideparams, logger=None):
@@ -217,5 +228,10 @@ class QFunctionTestTime(QFunction):
         pass
       
     def forward(self, inputs):
-      qvals = super().forward(inputs)
+      inputs = self._add_goal(inputs)
+      return self.score(inputs['current_img'], inputs['goal_img'])
+
+    def score(self, current_img, goal_img):
+      qs = self.sample_target_qs(torch.cat([current_img, goal_img], dim=1))
+      qvals = torch.max(qs, 0)[0].view(-1)
       return -1 * qvals
@@ -8,6 +8,8 @@ from classifier_control.classifier.utils.subnetworks import ConvEncoder
 from classifier_control.classifier.utils.spatial_softmax import SpatialSoftmax
 
 from classifier_control.classifier.models.base_model import BaseModel
+from classifier_control.classifier.models.utils.utils import select_indices
+from classifier_control.classifier.models.utils.index_sampler import TimeIndexSampler, PairFrameSampler
 from classifier_control.classifier.utils.layers import Linear
 
 
@@ -16,6 +18,8 @@ class SingleTempDistClassifier(BaseModel):
         super().__init__(logger)
         self._hp = hp
         self.tdist = tdist
+        # every classifier gets its own stream of indices
+        self._index_sampler = TimeIndexSampler(None if hp.sampler_seed is None else hp.sampler_seed + tdist)
         self.build_network()
 
     def build_network(self, build_encoder=True):
@@ -34,9 +38,9 @@ class SingleTempDistClassifier(BaseModel):
         :return: model_output
         """
 
-        import pdb; pdb.set_trace()
         tlen = inputs.demo_seq_images.shape[1]
-        pos_pairs, neg_pairs = self.sample_image_pair(inputs.demo_seq_images, tlen, self.tdist)
+        pos_pairs, neg_pairs = self.sample_image_pair(inputs.demo_seq_images, tlen, self.tdist,
+                                                       inputs.get('frame_inds'))
         image_pairs = torch.cat([pos_pairs, neg_pairs], dim=0)
         embeddings = self.encoder(image_pairs)
         embeddings = self.spatial_softmax(embeddings)
@@ -46,41 +50,46 @@ class SingleTempDistClassifier(BaseModel):
         model_output = AttrDict(logits=logits, out_sigmoid=self.out_sigmoid, pos_pair=self.pos_pair, neg_pair=self.neg_pair)
         return model_output
 
-    def sample_image_pair(self, images, tlen, tdist):
+    def sample_image_pair(self, images, tlen, tdist, frame_inds=None):
+        """
+        :param frame_inds: time indices of the frames in images if they are the sparse frames of a PairFrameSampler
+        over the temporal distances 1 ... ndist_max
+        """
+        if frame_inds is None:
+            pos_inds, neg_inds = self._index_sampler.sample_pairs(self._hp.batch_size, tlen, tdist, images.device)
+            pos_slots, neg_slots = pos_inds, neg_inds
+        else:
+            pos_inds, neg_inds, pos_slots, neg_slots = PairFrameSampler.split(frame_inds, tdist - 1)
 
         # get positives:
-        t0 = np.random.randint(0, tlen - tdist - 1, self._hp.batch_size)
-        t1 = t0 + 1 + np.random.randint(0, tdist, self._hp.batch_size)
-        t0, t1 = torch.from_numpy(t0), torch.from_numpy(t1)
+        t0, t1 = pos_inds
 
         # print('t0', t0)
         # print('t1', t1)
         # print('t1 - t0', t1 - t0)
 
-        im_t0 = select_indices(images, t0)
-        im_t1 = select_indices(images, t1)
+        im_t0 = select_indices(images, pos_slots[0])
+        im_t1 = select_indices(images, pos_slots[1])
 
         self.pos_pair = torch.stack([im_t0, im_t1], dim=1)
         pos_pair_cat = torch.cat([im_t0, im_t1], dim=1)
 
         # get negatives:
-        t0 = np.random.randint(0, tlen - tdist - 1, self._hp.batch_size)
-        t1 = [np.random.randint(t0[b] + tdist + 1, tlen, 1) for b in range(self._hp.batch_size)]
-        t1 = np.array(t1).squeeze()
-        t0, t1 = torch.from_numpy(t0), torch.from_numpy(t1)
+        t0, t1 = neg_inds
 
         # print('--------------')
         # print('t0', t0)
         # print('t1', t1)
         # print('t1 - t0', t1 - t0)
 
-        im_t0 = select_indices(images, t0)
-        im_t1 = select_indices(images, t1)
+        im_t0 = select_indices(images, neg_slots[0])
+        im_t1 = select_indices(images, neg_slots[1])
         self.neg_pair = torch.stack([im_t0, im_t1], dim=1)
         neg_pair_cat = torch.cat([im_t0, im_t1], dim=1)
 
         # one means within range of tdist range,  zero means outside of tdist range
-        self.labels = torch.cat([torch.ones(self._hp.batch_size), torch.zeros(self._hp.batch_size)])
+        self.labels = torch.cat([torch.ones(self._hp.batch_size, device=images.device),
+                                 torch.zeros(self._hp.batch_size, device=images.device)])
 
         return pos_pair_cat, neg_pair_cat
 
@@ -110,13 +119,6 @@ class SingleTempDistClassifier(BaseModel):
                                                           'tdist{}'.format(self.tdist), step, phase)
 
 
-def select_indices(tensor, indices):
-    new_images = []
-    for b in range(tensor.shape[0]):
-        new_images.append(tensor[b, indices[b]])
-    tensor = torch.stack(new_images, dim=0)
-    return tensor
-
 class TesttimeSingleTempDistClassifier(SingleTempDistClassifier):
     def __init__(self, params, tdist, logger):
         super().__init__(params, tdist, logger)
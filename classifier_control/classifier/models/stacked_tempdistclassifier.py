@@ -0,0 +1,204 @@
+from collections import OrderedDict
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from classifier_control.classifier.utils.general_utils import AttrDict
+from classifier_control.classifier.utils.subnetworks import ConvEncoder
+from classifier_control.classifier.utils.spatial_softmax import SpatialSoftmax
+from classifier_control.classifier.utils.layers import Linear
+
+from classifier_control.classifier.models.base_model import BaseModel
+from classifier_control.classifier.models.utils.utils import select_indices
+from classifier_control.classifier.models.utils.index_sampler import TimeIndexSampler, PairFrameSampler
+
+
+class StackedLinear(nn.Module):
+    """ n_stack independent linear layers applied to [N, n_stack * in_features] inputs.
+    The weight is the concatenation of the individual [out_features, in_features] weights along dim 0. """
+
+    def __init__(self, in_features, out_features, n_stack, bias=True):
+        super().__init__()
+        self.n_stack = n_stack
+        self.weight = nn.Parameter(torch.Tensor(out_features * n_stack, in_features))
+        if bias:
+            self.bias = nn.Parameter(torch.zeros(out_features * n_stack))
+        else:
+            self.register_parameter('bias', None)
+        nn.init.xavier_normal_(self.weight.data)
+
+    def forward(self, input):
+        return F.conv1d(input.unsqueeze(-1), self.weight.unsqueeze(-1), self.bias, groups=self.n_stack).squeeze(-1)
+
+
+def stack_module(module, n_stack):
+    """ Builds a module that evaluates n_stack independent copies of module on inputs stacked along the channels.
+    Convolutions become grouped convolutions, parameter names are kept so that checkpoints can be converted. """
+    if isinstance(module, nn.Conv2d):
+        return nn.Conv2d(module.in_channels * n_stack, module.out_channels * n_stack, module.kernel_size,
+                         module.stride, module.padding, groups=n_stack, bias=module.bias is not None)
+    elif isinstance(module, nn.Linear):
+        return StackedLinear(module.in_features, module.out_features, n_stack, bias=module.bias is not None)
+    elif isinstance(module, (nn.BatchNorm1d, nn.BatchNorm2d, nn.InstanceNorm1d, nn.InstanceNorm2d)):
+        # these normalize every channel independently
+        return type(module)(module.num_features * n_stack, eps=module.eps, momentum=module.momentum,
+                            affine=module.affine, track_running_stats=module.track_running_stats)
+    elif isinstance(module, nn.Sequential):
+        stacked = nn.Sequential()
+        for name, child in module.named_children():
+            stacked.add_module(name, stack_module(child, n_stack))
+        return stacked
+    elif isinstance(module, (nn.LeakyReLU, nn.ReLU)):
+        return module
+    raise NotImplementedError("Module type {} cannot be stacked".format(type(module)))
+
+
+def stack_state_dict(state_dict, stacked_module, n_stack, src_prefix, tgt_prefix):
+    """
+    Converts the weights of n_stack individual networks into the weights of the stacked network
+    :param state_dict: state dict containing the keys src_prefix + '<i>.<param name>'
+    :return: state dict with keys tgt_prefix + '<param name>'
+    """
+    stacked_state_dict = OrderedDict()
+    for key, target in stacked_module.state_dict().items():
+        values = [state_dict['{}{}.{}'.format(src_prefix, i, key)] for i in range(n_stack)]
+        if values[0].shape == target.shape:
+            value = values[0]   # shared buffers and counters
+        else:
+            value = torch.cat(values, dim=0)
+        assert value.shape == target.shape, "cannot convert {}, {} vs {}".format(key, value.shape, target.shape)
+        stacked_state_dict[tgt_prefix + key] = value
+    return stacked_state_dict
+
+
+class StackedConvEncoder(nn.Module):
+    def __init__(self, hp, n_stack):
+        super().__init__()
+        assert not hp.use_skips, "skip connections are not supported by the stacked encoder"
+        encoder = ConvEncoder(hp)
+        self._output_size = encoder.get_output_size()
+        self.net = stack_module(encoder.net, n_stack)
+
+    def get_output_size(self):
+        """ output size of every individual network """
+        return self._output_size
+
+    def forward(self, input, shared_input=False):
+        """
+        :param input: channel-stacked inputs, or a single input for all networks if shared_input is True
+        """
+        if not shared_input:
+            return self.net(input)
+
+        # all networks see the same input, the first convolution does not need to be grouped
+        blocks = list(self.net.children())
+        first_block = list(blocks[0].children()) if isinstance(blocks[0], nn.Sequential) else [blocks[0]]
+        x = input
+        for module in first_block:
+            if isinstance(module, nn.Conv2d):
+                x = F.conv2d(x, module.weight, module.bias, module.stride, module.padding)
+            else:
+                x = module(x)
+        for block in blocks[1:]:
+            x = block(x)
+        return x
+
+
+class StackedTempDistClassifier(BaseModel):
+    """
+    Evaluates the ndist_max classifiers of BaseTempDistClassifier in a single pass. The per-distance networks are
+    stacked along the channel dimension and evaluated as grouped convolutions, every classifier keeps its own weights.
+    """
+
+    def __init__(self, hp, logger):
+        super().__init__(logger)
+        self._hp = hp
+        self.tdists = [i + 1 for i in range(self._hp.ndist_max)]
+        # same index streams as the sequential classifiers
+        self._index_samplers = [TimeIndexSampler(None if hp.sampler_seed is None else hp.sampler_seed + tdist)
+                                for tdist in self.tdists]
+        self.build_network()
+
+    def build_network(self, build_encoder=True):
+        n_stack = len(self.tdists)
+        self.encoder = StackedConvEncoder(self._hp, n_stack)
+        out_size = self.encoder.get_output_size()
+        self.spatial_softmax = SpatialSoftmax(out_size[1], out_size[2], out_size[0] * n_stack)  # height, width, channel
+        self.linear = stack_module(Linear(in_dim=out_size[0]*2, out_dim=1, builder=self._hp.builder), n_stack)
+
+        self.cross_ent_loss = nn.BCEWithLogitsLoss()
+
+    def forward(self, inputs):
+        """
+        forward pass at training time
+        :param
+            images shape = batch x time x channel x height x width
+            or at test time current_img and goal_img with shape batch x channel x height x width
+        :return: list of model outputs, one per temporal distance
+        """
+        if 'demo_seq_images' in inputs:
+            image_pairs = self.sample_image_pairs(inputs.demo_seq_images, inputs.get('frame_inds'))
+            logits = self.make_prediction(image_pairs)
+        else:
+            image_pairs = torch.cat([inputs['current_img'], inputs['goal_img']], dim=1)
+            logits = self.make_prediction(image_pairs, shared_input=True)
+            self.pos_pairs = self.neg_pairs = [None for _ in self.tdists]
+
+        self.out_sigmoid = torch.sigmoid(logits)
+        model_output = []
+        for i in range(len(self.tdists)):
+            model_output.append(AttrDict(logits=logits[:, i:i+1], out_sigmoid=self.out_sigmoid[:, i:i+1],
+                                         pos_pair=self.pos_pairs[i], neg_pair=self.neg_pairs[i]))
+        return model_output
+
+    def make_prediction(self, image_pairs, shared_input=False):
+        embeddings = self.encoder(image_pairs, shared_input)
+        embeddings = self.spatial_softmax(embeddings)
+        return self.linear(embeddings)
+
+    def sample_image_pairs(self, images, frame_inds=None):
+        """
+        Samples positive and negative pairs for every temporal distance and stacks them along the channels
+        :param frame_inds: time indices of the frames in images if they are the sparse frames of a PairFrameSampler
+        over tdists
+        """
+        tlen = images.shape[1]
+        self.pos_pairs, self.neg_pairs = [], []
+        image_pairs = []
+        for i, (tdist, sampler) in enumerate(zip(self.tdists, self._index_samplers)):
+            if frame_inds is None:
+                pos_slots, neg_slots = sampler.sample_pairs(self._hp.batch_size, tlen, tdist, images.device)
+            else:
+                _, _, pos_slots, neg_slots = PairFrameSampler.split(frame_inds, i)
+            pos_pair = torch.stack([select_indices(images, pos_slots[0]), select_indices(images, pos_slots[1])], dim=1)
+            neg_pair = torch.stack([select_indices(images, neg_slots[0]), select_indices(images, neg_slots[1])], dim=1)
+            self.pos_pairs.append(pos_pair)
+            self.neg_pairs.append(neg_pair)
+            image_pairs.append(torch.cat([pos_pair.flatten(1, 2), neg_pair.flatten(1, 2)], dim=0))
+
+        # one means within range of tdist range,  zero means outside of tdist range
+        self.labels = torch.cat([torch.ones(self._hp.batch_size, device=images.device),
+                                 torch.zeros(self._hp.batch_size, device=images.device)])
+        return torch.cat(image_pairs, dim=1)
+
+    def loss(self, model_output):
+        losses = AttrDict()
+        for tdist, output in zip(self.tdists, model_output):
+            setattr(losses, 'tdist{}'.format(tdist), self.cross_ent_loss(output.logits[:, 0], self.labels))
+        return losses
+
+    def _log_outputs(self, model_output, inputs, losses, step, log_images, phase):
+        labels = self.labels.data.cpu().numpy()
+        out_sigmoid = self.out_sigmoid.data.cpu().numpy()
+        for i, tdist in enumerate(self.tdists):
+            predictions = (out_sigmoid[:, i] > 0.5).astype(np.float32)
+            false_positive_rate = np.sum(predictions[labels == 0]) / float(np.sum(labels == 0))
+            false_negative_rate = np.sum(1 - predictions[labels == 1]) / float(np.sum(labels == 1))
+
+            self._logger.log_scalar(false_positive_rate, 'tdist{}_false_postive_rate'.format(tdist), step, phase)
+            self._logger.log_scalar(false_negative_rate, 'tdist{}_false_negative_rate'.format(tdist), step, phase)
+
+            if log_images:
+                self._logger.log_single_tdist_classifier_image(self.pos_pairs[i], self.neg_pairs[i],
+                                                               self.out_sigmoid[:, i:i+1],
+                                                               'tdist{}'.format(tdist), step, phase)
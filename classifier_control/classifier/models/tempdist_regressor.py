@@ -14,6 +14,7 @@ from classifier_control.classifier.models.single_tempdistclassifier import Singl
 from classifier_control.classifier.models.single_tempdistclassifier import TesttimeSingleTempDistClassifier
 
 from classifier_control.classifier.models.utils.utils import select_indices
+from classifier_control.classifier.models.utils.index_sampler import TimeIndexSampler, OrderedPairFrameSampler
 
 class TempdistRegressor(BaseModel):
     def __init__(self, overrideparams, logger=None):
@@ -26,6 +27,7 @@ class TempdistRegressor(BaseModel):
         assert self._hp.batch_size != -1   # make sure that batch size was overridden
 
         self.tdist_classifiers = []
+        self._index_sampler = TimeIndexSampler(self._hp.sampler_seed)
         self.build_network()
 
     def _default_hparams(self):
@@ -54,20 +56,26 @@ class TempdistRegressor(BaseModel):
         self.linear = Linear(in_dim=out_size[0]*2, out_dim=1, builder=self._hp.builder)
 
 
-    def sample_image_pair(self, images):
+    def get_frame_sampler(self):
+        return OrderedPairFrameSampler()
 
+    def sample_image_pair(self, images, frame_inds=None):
+        """
+        :param frame_inds: time indices of the frames in images if they are the sparse frames of get_frame_sampler
+        """
         tlen = images.shape[1]
 
         # get positives:
-        t0 = np.random.randint(0, tlen, self._hp.batch_size)
-        t1 = np.array([np.random.randint(t0[b], tlen, 1) for b in range(images.shape[0])]).squeeze()
-
-        t0, t1 = torch.from_numpy(t0), torch.from_numpy(t1)
+        if frame_inds is None:
+            t0, t1 = self._index_sampler.sample_ordered_pairs(self._hp.batch_size, tlen, images.device)
+            s0, s1 = t0, t1
+        else:
+            (t0, t1), (s0, s1) = OrderedPairFrameSampler.split(frame_inds)
 
-        im_t0 = select_indices(images, t0)
-        im_t1 = select_indices(images, t1)
+        im_t0 = select_indices(images, s0)
+        im_t1 = select_indices(images, s1)
 
-        self.labels = torch.clamp_max(t1 - t0, self._hp.tmax_label).type(torch.FloatTensor)
+        self.labels = torch.clamp_max(t1 - t0, self._hp.tmax_label).float()
 
         img_pair_stack = torch.stack([im_t0, im_t1], dim=1)
         return img_pair_stack
@@ -79,7 +87,7 @@ class TempdistRegressor(BaseModel):
             images shape = batch x time x channel x height x width
         :return: model_output
         """
-        image_pairs = self.sample_image_pair(inputs.demo_seq_images)
+        image_pairs = self.sample_image_pair(inputs.demo_seq_images, inputs.get('frame_inds'))
         self.img_pair = image_pairs
         model_output = self.make_prediction(image_pairs)
         return model_output
@@ -94,7 +102,7 @@ class TempdistRegressor(BaseModel):
 
     def _log_outputs(self, model_output, inputs, losses, step, log_images, phase):
         if log_images:
-            self._logger.log_pair_predictions(self.img_pair, self.tdist_estimates, self.labels,'tdist_regression', step, phase)
+            self._logger.log_pair_predictions(self.img_pair, self.tdist_estimates, self.labels.cpu(),'tdist_regression', step, phase)
 
 
     def loss(self, model_output):
@@ -132,9 +140,12 @@ class TempdistRegressorTestTime(TempdistRegressor):
             images shape = batch x time x channel x height x width
         :return: model_output
         """
-        image_pairs = torch.stack([inputs['current_img'], inputs['goal_img']], dim=1)
-        expected_distance = self.make_prediction(image_pairs).tdist_estimates.data.cpu().numpy().squeeze()
-        return expected_distance
+        inputs = self._add_goal(inputs)
+        return self.score(inputs['current_img'], inputs['goal_img'])
+
+    def score(self, current_img, goal_img):
+        image_pairs = torch.stack([current_img, goal_img], dim=1)
+        return self.make_prediction(image_pairs).tdist_estimates.view(-1)
 
     def visualize_test_time(self, content_dict, visualize_indices, verbose_folder):
         pass
@@ -0,0 +1,47 @@
+import torch
+
+
+class DistributionalTarget:
+    """
+    Distributional Bellman target of DistQFunction for a whole batch. Of the target distributions over the temporal
+    distance bins of all action samples, the one with the lowest expected distance is selected and shifted by one
+    step. Examples whose next state is the goal get all mass on the first bin.
+    The output buffer is reused, the returned tensor is overwritten by the next call.
+    """
+
+    def __init__(self, n_bins):
+        self.n_bins = n_bins
+        self._support = None
+        self._target = None
+
+    def _get_buffers(self, qs):
+        batch_size = qs.shape[1]
+        if self._target is None or self._target.shape[0] != batch_size or self._target.device != qs.device \
+                or self._target.dtype != qs.dtype:
+            self._support = torch.arange(1, self.n_bins + 1, device=qs.device, dtype=qs.dtype)
+            self._target = torch.empty(batch_size, self.n_bins, device=qs.device, dtype=qs.dtype)
+        return self._support, self._target
+
+    def __call__(self, qs, is_goal):
+        """
+        :param qs: target distributions, n_action_samples x batch x n_bins
+        :param is_goal: batch, one if the next state is the goal
+        :return: target distributions, batch x n_bins
+        """
+        assert qs.shape[2] == self.n_bins
+        support, target = self._get_buffers(qs)
+
+        ## Select the distribution with the lowest expected distance for every example
+        ids = torch.matmul(qs, support).min(0)[1]
+        best = torch.gather(qs, 0, ids[None, :, None].expand(1, qs.shape[1], self.n_bins))[0]
+
+        ## Shift Q*(s_t+1) to get Q*(s_t), the last bin accumulates everything beyond the horizon
+        target[:, 0] = 0
+        target[:, 1:] = best[:, :-1]
+        target[:, -1] += best[:, -1]
+
+        ## If next state is goal then target should be 0, else should be shifted
+        is_goal = is_goal.to(qs.dtype)
+        target.mul_(1 - is_goal[:, None])
+        target[:, 0] += is_goal
+        return target
@@ -0,0 +1,164 @@
+import numpy as np
+import torch
+
+
+def make_generator(device, seed):
+    """
+    Seeded torch generator for draws on device. torch.Generator only takes a device from torch 1.5 on, older versions
+    fall back to a CPU generator whose draws have to be moved to device
+    :return: generator, device the generator draws on
+    """
+    try:
+        generator = torch.Generator(device=device)
+    except TypeError:
+        generator, device = torch.Generator(), torch.device('cpu')
+    generator.manual_seed(seed)
+    return generator, device
+
+
+class TimeIndexSampler:
+    """
+    Draws the time indices of positive and negative training examples for a whole batch at once.
+    All indices are sampled on the device of the data with a single torch generator, so sampling requires no
+    host-device synchronization. With torch < 1.5 the generator is on the CPU and the indices are copied to the device.
+    """
+
+    def __init__(self, seed=None):
+        """
+
+        :param seed: seed of the generator, if None it is drawn from the global torch RNG on first use
+        """
+        self._seed = seed
+        self._generator = None
+        self._device = None
+
+    def _get_generator(self, device):
+        """ :return: generator for indices on device, device the generator draws on """
+        if self._generator is None or self._device != device:
+            if self._seed is None:
+                self._seed = int(torch.randint(2**62, (1,)).item())
+            self._generator, self._generator_device = make_generator(device, self._seed)
+            self._device = device
+        return self._generator, self._generator_device
+
+    def randint(self, low, high, batch_size, device):
+        """ Uniform integers in [low, high), low and high are ints or [batch_size] tensors on device """
+        device = torch.device(device)
+        if device.type == 'cuda' and device.index is None:
+            device = torch.device('cuda', torch.cuda.current_device())
+        generator, generator_device = self._get_generator(device)
+        if not torch.is_tensor(low) and not torch.is_tensor(high):
+            inds = torch.randint(high - low, (batch_size,), generator=generator, device=generator_device)
+            return low + inds.to(device)
+        u = torch.rand(batch_size, generator=generator, device=generator_device).to(device)
+        inds = low + (u * (high - low)).long()
+        return torch.min(inds, torch.as_tensor(high, device=device) - 1)   # guards against u * n rounding up to n
+
+    def sample_pairs(self, batch_size, tlen, tdist, device):
+        """
+        Samples index pairs (t0, t1) for a temporal distance classifier
+        :return: positives with 0 < t1 - t0 <= tdist, negatives with t1 - t0 > tdist
+        """
+        t0 = self.randint(0, tlen - tdist - 1, batch_size, device)
+        t1 = t0 + 1 + self.randint(0, tdist, batch_size, device)
+        pos = (t0, t1)
+
+        t0 = self.randint(0, tlen - tdist - 1, batch_size, device)
+        t1 = self.randint(t0 + tdist + 1, tlen, batch_size, device)
+        neg = (t0, t1)
+        return pos, neg
+
+    def sample_triplets(self, batch_size, tlen, tdist, device):
+        """
+        Samples index triplets (t0, t0 + 1, tg) of a transition and a goal, as used by the Q-functions
+        :return: positives with tg - t0 <= tdist, negatives with tg - t0 > tdist
+        """
+        (t0, tg), (neg_t0, neg_tg) = self.sample_pairs(batch_size, tlen, tdist, device)
+        return (t0, t0 + 1, tg), (neg_t0, neg_t0 + 1, neg_tg)
+
+    def sample_ordered_pairs(self, batch_size, tlen, device):
+        """ Samples pairs with t0 uniform in [0, tlen) and t1 uniform in [t0, tlen), as used by the regressors """
+        t0 = self.randint(0, tlen, batch_size, device)
+        t1 = self.randint(t0, tlen, batch_size, device)
+        return t0, t1
+
+
+class FrameSampler:
+    """
+    Draws the time indices of all frames a model uses from one trajectory, in the data loader workers. With
+    data_conf.sparse_frames the dataset only reads these frames and returns them in the slot order of the sampler,
+    together with their time indices as frame_inds.
+    """
+    n_slots = None
+
+    def __call__(self, tlen, rng=np.random):
+        """
+        :param tlen: length of the trajectory
+        :param rng: numpy random state of the worker
+        :return: time index of every slot, int64 array of shape n_slots
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _sample_pair(tlen, tdist, rng):
+        """ Same distribution as TimeIndexSampler.sample_pairs for a single trajectory """
+        t0 = rng.randint(0, tlen - tdist - 1)
+        t1 = t0 + 1 + rng.randint(0, tdist)
+        neg_t0 = rng.randint(0, tlen - tdist - 1)
+        neg_t1 = rng.randint(neg_t0 + tdist + 1, tlen)
+        return [t0, t1, neg_t0, neg_t1]
+
+
+class TripletFrameSampler(FrameSampler):
+    """ Slots t0, t0 + 1, tg of a positive and neg_t0, neg_t0 + 1, neg_tg of a negative example, see sample_triplets """
+    n_slots = 6
+
+    def __init__(self, tdist=1):
+        self.tdist = tdist
+
+    def __call__(self, tlen, rng=np.random):
+        t0, tg, neg_t0, neg_tg = self._sample_pair(tlen, self.tdist, rng)
+        return np.array([t0, t0 + 1, tg, neg_t0, neg_t0 + 1, neg_tg], dtype=np.int64)
+
+    @staticmethod
+    def split(frame_inds):
+        """
+        :param frame_inds: time indices of the slots, batch x n_slots
+        :return: positive and negative time indices as returned by sample_triplets and the slots holding their frames
+        """
+        return frame_inds[:, :3].unbind(1), frame_inds[:, 3:].unbind(1), (0, 1, 2), (3, 4, 5)
+
+
+class PairFrameSampler(FrameSampler):
+    """ Slots t0, t1, neg_t0, neg_t1 for every temporal distance in tdists, see sample_pairs """
+
+    def __init__(self, tdists):
+        self.tdists = list(tdists)
+        self.n_slots = 4 * len(self.tdists)
+
+    def __call__(self, tlen, rng=np.random):
+        return np.array([t for tdist in self.tdists for t in self._sample_pair(tlen, tdist, rng)], dtype=np.int64)
+
+    @staticmethod
+    def split(frame_inds, i):
+        """
+        :param frame_inds: time indices of the slots, batch x n_slots
+        :param i: position of the temporal distance in tdists
+        :return: positive and negative time indices as returned by sample_pairs and the slots holding their frames
+        """
+        slots = frame_inds[:, 4 * i:4 * i + 4].unbind(1)
+        return slots[:2], slots[2:], (4 * i, 4 * i + 1), (4 * i + 2, 4 * i + 3)
+
+
+class OrderedPairFrameSampler(FrameSampler):
+    """ Slots t0, t1 with t0 <= t1, see sample_ordered_pairs """
+    n_slots = 2
+
+    def __call__(self, tlen, rng=np.random):
+        t0 = rng.randint(0, tlen)
+        return np.array([t0, rng.randint(t0, tlen)], dtype=np.int64)
+
+    @staticmethod
+    def split(frame_inds):
+        """ :return: time indices t0, t1 as returned by sample_ordered_pairs and the slots holding their frames """
+        return frame_inds.unbind(1), (0, 1)
@@ -0,0 +1,62 @@
+import torch
+
+
+class TargetNetworkUpdater:
+    """
+    Keeps a target network in sync with a source network by in-place updates of its parameters.
+    Every interval calls of update() the target parameters are moved towards the source parameters with Polyak
+    averaging, target = (1 - tau) * target + tau * source; tau = 1 gives hard updates. Buffers such as batch norm
+    statistics are copied.
+    """
+
+    def __init__(self, source, target, tau=1.0, interval=1):
+        """
+
+        :param source: online network
+        :param target: target network with the same architecture, on the same device as source
+        :param tau: Polyak averaging coefficient in (0, 1]
+        :param interval: number of update() calls between two target updates
+        """
+        assert 0. < tau <= 1., "tau needs to be in (0, 1]"
+        assert interval >= 1
+        self.tau = tau
+        self.interval = interval
+        self._n_calls = 0
+
+        # the modules are kept instead of their tensors since module.to() replaces the buffer tensors
+        self._source = source
+        self._target = target
+        for param in target.parameters():
+            param.requires_grad_(False)
+        self.hard_update()
+
+    @torch.no_grad()
+    def hard_update(self):
+        for target, source in zip(self._target.parameters(), self._source.parameters()):
+            target.copy_(source)
+        self._copy_buffers()
+
+    @torch.no_grad()
+    def soft_update(self):
+        target_params, source_params = list(self._target.parameters()), list(self._source.parameters())
+        if hasattr(torch, '_foreach_mul_'):
+            torch._foreach_mul_(target_params, 1. - self.tau)
+            torch._foreach_add_(target_params, source_params, alpha=self.tau)
+        else:
+            for target, source in zip(target_params, source_params):
+                target.mul_(1. - self.tau).add_(source, alpha=self.tau)
+        self._copy_buffers()
+
+    def _copy_buffers(self):
+        for target, source in zip(self._target.buffers(), self._source.buffers()):
+            target.copy_(source)
+
+    def update(self):
+        """ To be called once per training step """
+        self._n_calls += 1
+        if self._n_calls % self.interval != 0:
+            return
+        if self.tau == 1.:
+            self.hard_update()
+        else:
+            self.soft_update()
@@ -1,8 +1,6 @@
 import torch
 
 def select_indices(tensor, indices):
-    new_images = []
-    for b in range(tensor.shape[0]):
-        new_images.append(tensor[b, indices[b]])
-    tensor = torch.stack(new_images, dim=0)
-    return tensor
\ No newline at end of file
+    """ Picks one time step per batch element: tensor [B, T, ...], indices [B] -> [B, ...] in a single gather """
+    batch_inds = torch.arange(tensor.shape[0], device=tensor.device)
+    return tensor[batch_inds, torch.as_tensor(indices, device=tensor.device)]
@@ -4,7 +4,7 @@ import torch
 from visual_mpc.policy.cem_controllers.visualizer.construct_html import save_imgs_direct
 from classifier_control.classifier.utils.general_utils import AttrDict
 import torch.nn as nn
-from classifier_control.classifier.models.base_tempdistclassifier import BaseTempDistClassifier
+from classifier_control.classifier.models.base_tempdistclassifier import BaseTempDistClassifier, expected_distance
 from classifier_control.classifier.models.variants.single_tempdistclassifier_monotoncity import SingleTempDistClassifierMonotone
 
 
@@ -14,6 +14,10 @@ class MonotonicityBaseTempDistClassifier(BaseTempDistClassifier):
     def singletempdistclassifier(self):
         return SingleTempDistClassifierMonotone
 
+    def build_network(self, build_encoder=True):
+        assert not self._hp.stacked_ensemble, "the monotonicity variant chains the classifiers, it cannot be stacked"
+        super().build_network(build_encoder)
+
     def forward(self, inputs):
         """
         forward pass at training time
@@ -26,7 +30,7 @@ class MonotonicityBaseTempDistClassifier(BaseTempDistClassifier):
         for c in self.tdist_classifiers:
             outdict = c(inputs)
             if accuml_fractions is None:
-                accuml_fractions = torch.ones(outdict.fraction.shape[0], device=self._hp.device)
+                accuml_fractions = torch.ones_like(outdict.fraction[:, 0])
             accuml_fractions = accuml_fractions*outdict.fraction.squeeze()
             c.out_sigmoid = accuml_fractions
             outdict.logits = torch.log(accuml_fractions)
@@ -59,22 +63,13 @@ class MonotonicityBaseTempDistClassifierTestTime(MonotonicityBaseTempDistClassif
         return TesttimeSingleTempDistClassifier
 
     def forward(self, inputs):
-        outputs = super().forward(inputs)
+        inputs = self._add_goal(inputs)
+        return self.score(inputs['current_img'], inputs['goal_img'])
 
-        sigmoid = []
-        for i in range(self._hp.ndist_max):
-            import pdb; pdb.set_trace()
-            sigmoid.append(outputs[i].out_sigmoid.data.cpu().numpy().squeeze())
-        self.sigmoids = np.stack(sigmoid, axis=1)
-        sigmoids_shifted = np.concatenate((np.zeros([self._hp.batch_size, 1]), self.sigmoids[:, :-1]), axis=1)
-        differences = self.sigmoids - sigmoids_shifted
-        self.softmax_differences = softmax(differences, axis=1)
-        expected_dist = np.sum((1 + np.arange(self.softmax_differences.shape[1])[None]) * self.softmax_differences, 1)
+    def score(self, current_img, goal_img):
+        outputs = super().forward(AttrDict(current_img=current_img, goal_img=goal_img))
 
+        self.sigmoids = torch.stack([outputs[i].out_sigmoid.view(-1) for i in range(self._hp.ndist_max)], dim=1)
+        expected_dist, self.softmax_differences = expected_distance(self.sigmoids)
         return expected_dist
 
-def softmax(array, axis=0):
-    exp = np.exp(array)
-    exp = exp/(np.sum(exp, axis=axis)[:, None] + 1e-5)
-    return exp
-
@@ -14,7 +14,8 @@ class SingleTempDistClassifierMonotone(SingleTempDistClassifier):
         """
 
         tlen = inputs.demo_seq_images.shape[1]
-        pos_pairs, neg_pairs = self.sample_image_pair(inputs.demo_seq_images, tlen, self.tdist)
+        pos_pairs, neg_pairs = self.sample_image_pair(inputs.demo_seq_images, tlen, self.tdist,
+                                                       inputs.get('frame_inds'))
         image_pairs = torch.cat([pos_pairs, neg_pairs], dim=0)
         embeddings = self.encoder(image_pairs)
         embeddings = self.spatial_softmax(embeddings)
@@ -0,0 +1,69 @@
+""" DistributionalTarget against the per-example loop it replaced in DistQFunction.loss """
+import pytest
+import torch
+
+from classifier_control.classifier.models.utils.distributional_target import DistributionalTarget
+
+
+def distributional_target_loop(qs, labels, n_bins):
+    """ Reference: the target computation of DistQFunction.loss before it was batched """
+    device = qs.device
+    batch_size = qs.shape[1]
+    qval = torch.sum((1 + torch.arange(qs.shape[2])[None]).float().to(device) * qs, 2)
+    ids = qval.min(0)[1]
+    newqs = []
+    for k in range(batch_size):
+        newqs.append(qs[ids[k], k])
+    qs = torch.stack(newqs)
+
+    shifted = torch.zeros(qs.size()).to(device)
+    shifted[:, 1:] = qs[:, :-1]
+    shifted[:, -1] += qs[:, -1]
+    lb = labels.to(device).unsqueeze(-1)
+    isg = torch.zeros((batch_size, n_bins)).to(device)
+    isg[:, 0] = 1
+    return (lb * isg) + ((1 - lb) * shifted)
+
+
+def random_inputs(seed, n_action_samples=20, batch_size=32, n_bins=10):
+    generator = torch.Generator()
+    generator.manual_seed(seed)
+    qs = torch.softmax(torch.randn(n_action_samples, batch_size, n_bins, generator=generator) * 3, 2)
+    # some examples put most of their mass on the last bin, which the shift has to keep there
+    qs[:, :batch_size // 4, -1] += 10
+    qs = qs / qs.sum(2, keepdim=True)
+    is_goal = (torch.rand(batch_size, generator=generator) < 0.3).float()
+    return qs, is_goal
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2, 3, 4])
+def test_matches_loop(seed):
+    qs, is_goal = random_inputs(seed)
+    target = DistributionalTarget(qs.shape[2])(qs, is_goal)
+    assert torch.allclose(target, distributional_target_loop(qs, is_goal, qs.shape[2]), atol=1e-6)
+
+
+def test_terminal_transitions():
+    qs, _ = random_inputs(0)
+    is_goal = torch.ones(qs.shape[1])
+    target = DistributionalTarget(qs.shape[2])(qs, is_goal)
+    expected = torch.zeros_like(target)
+    expected[:, 0] = 1
+    assert torch.equal(target, expected)
+
+
+def test_last_bin_accumulates():
+    qs = torch.zeros(1, 2, 4)
+    qs[0, 0] = torch.tensor([0., 0., 0., 1.])
+    qs[0, 1] = torch.tensor([0., 0., 0.5, 0.5])
+    target = DistributionalTarget(4)(qs, torch.zeros(2))
+    assert torch.equal(target, torch.tensor([[0., 0., 0., 1.], [0., 0., 0., 1.]]))
+    assert torch.allclose(target.sum(1), torch.ones(2))
+
+
+def test_buffer_reuse_across_batch_sizes():
+    distributional_target = DistributionalTarget(10)
+    for seed, batch_size in [(0, 32), (1, 8), (2, 32)]:
+        qs, is_goal = random_inputs(seed, batch_size=batch_size)
+        target = distributional_target(qs, is_goal).clone()
+        assert torch.allclose(target, distributional_target_loop(qs, is_goal, 10), atol=1e-6)
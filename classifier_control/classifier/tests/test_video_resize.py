@@ -0,0 +1,32 @@
+""" PIL parity of the default backend of video_resize.resize_batch """
+import numpy as np
+import pytest
+from PIL import Image
+from torchvision.transforms import Resize
+
+from classifier_control.classifier.utils.video_resize import resize_batch
+
+# maximum pixel difference to PIL, cv2 rounds the bilinear weights differently when upsampling
+MAX_DIFF = 2
+
+
+def resize_reference(video, size):
+    """ The per-frame torchvision/PIL loop resize_video used before resize_batch """
+    frames = video.reshape((-1,) + video.shape[-3:])
+    resized = np.stack([np.asarray(Resize(size)(Image.fromarray(im))) for im in frames], axis=0)
+    return resized.reshape(video.shape[:-3] + resized.shape[1:])
+
+
+@pytest.mark.parametrize('src_sz, target_sz', [((48, 64), (64, 64)),        # upsampling, the 48x64 datasets
+                                               ((240, 320), (64, 64)),      # downsampling, full resolution
+                                               ((64, 64), (48, 64))])       # downsampling of the height only
+@pytest.mark.parametrize('batch_shape', [(31,), (4, 7)])
+def test_default_backend_matches_pil(src_sz, target_sz, batch_shape):
+    rng = np.random.RandomState(0)
+    video = rng.randint(0, 256, batch_shape + src_sz + (3,)).astype(np.uint8)
+    resized = resize_batch(video, target_sz, backend='default')
+    reference = resize_reference(video, target_sz)
+    assert resized.shape == reference.shape
+    assert resized.dtype == np.uint8
+    diff = np.abs(resized.astype(np.int32) - reference.astype(np.int32))
+    assert diff.max() <= MAX_DIFF, 'default backend deviates from PIL by {}'.format(diff.max())
@@ -1,11 +1,52 @@
+import contextlib
+from functools import partial
 import yaml
+import numpy as np
 import torch
+from torch.nn.parallel import parallel_apply
 from classifier_control.baseline_costs.image_mse_cost import ImageMseCost
+from classifier_control.classifier.utils.cpu_inference import CPU_INFERENCE_DEFAULTS, optimize_for_cpu, \
+    prepare_cpu_inputs, cpu_autocast
+from classifier_control.classifier.utils.general_utils import AttrDict
+
+
+def get_devices(placement):
+    """
+    :param placement: None for the first gpu if available and the cpu otherwise, a device name such as 'cpu', 'cuda'
+    or 'cuda:1', or a list of device names, either as list or comma-separated
+    :return: list of torch devices
+    """
+    if placement is None:
+        placement = 'cuda' if torch.cuda.is_available() else 'cpu'
+    if isinstance(placement, str):
+        placement = placement.split(',')
+    elif isinstance(placement, torch.device):
+        placement = [placement]
+    devices = [torch.device(device) for device in placement]
+    if len(devices) > 1 and any(device.type != 'cuda' for device in devices):
+        raise ValueError("only gpus can be used for multi-device placement, got {}".format(placement))
+    return devices
+
 
 class DistFuncEvaluation():
     def __init__(self, testmodel, testparams):
+        """
+
+        :param testmodel: test-time model class
+        :param testparams: parameters overriding the training config of the model. The optional entry 'device' sets
+        the placement, see get_devices; with several devices the model is replicated and every predict call is sharded
+        across the replicas. The optional entry 'cpu_inference' runs the model on the CPU with the optimizations set
+        in it, see CPU_INFERENCE_DEFAULTS
+        """
+        testparams = dict(testparams)
+        cpu_inference = testparams.pop('cpu_inference', None)
+        placement = testparams.pop('device', None)
+        self._cpu_inference = None
         if testmodel is ImageMseCost:
             self.model = ImageMseCost()
+            self.models = [self.model]
+            self.devices = [torch.device(self.model.get_device())]
+            self.max_batch_size = -1
         else:
             model_path = testparams['classifier_restore_path']
             if model_path is not None:
@@ -16,11 +57,84 @@ class DistFuncEvaluation():
             overrideparams.pop('builder')
             overrideparams.update(testparams)
             overrideparams['ignore_same_as_default'] = ''  # adding this flag prevents error because of value being equal to default
-            self.model = testmodel(overrideparams)
-            self.model.to(torch.device('cuda'))
+            if cpu_inference is not None:
+                assert placement in [None, 'cpu'], "cpu_inference requires the cpu as device"
+                placement = 'cpu'
+                self._cpu_inference = AttrDict(CPU_INFERENCE_DEFAULTS)
+                self._cpu_inference.update(cpu_inference)
+            self.devices = get_devices(placement)
+
+            self.models = []
+            for device in self.devices:
+                overrideparams['device'] = str(device)
+                model = testmodel(overrideparams)
+                model.to(device)
+                if self._cpu_inference is not None:
+                    optimize_for_cpu(model, self._cpu_inference)
+                model.eval()
+                self.models.append(model)
+            self.model = self.models[0]
+            self.max_batch_size = self.model._hp.max_batch_size
+
+    def get_device(self):
+        """ device of the first replica, inputs and goals are expected there """
+        return self.devices[0]
+
+    def visualize_test_time(self, content_dict, visualize_indices, verbose_folder):
+        if len(self.models) > 1:
+            print('test time visualization is only supported for a single device')
+            return
+        self.model.visualize_test_time(content_dict, visualize_indices, verbose_folder)
+
+    def set_goal(self, goal_img):
+        """ Sets the goal, 1 x channel x height x width, that predict compares inputs without 'goal_img' to """
+        for model, device in zip(self.models, self.devices):
+            model.set_goal(goal_img.to(device))
 
     def predict(self, inputs):
-        return self.model(inputs)
+        """
+        Scores a batch of current and goal images. With several devices the batch is split evenly across the
+        replicas, which run in parallel, and the scores are gathered on the first device. Batches larger than the
+        max_batch_size of the model are evaluated in chunks and the scores are concatenated.
+        """
+        if self._cpu_inference is not None:
+            inputs = prepare_cpu_inputs(inputs, self._cpu_inference)
+        with torch.no_grad(), self._inference_context():
+            if len(self.models) == 1:
+                return self._predict_chunks(self.model, inputs)
+            return self._predict_sharded(inputs)
+
+    def _predict_chunks(self, model, inputs):
+        batch_size = inputs['current_img'].shape[0]
+        chunk_size = batch_size if self.max_batch_size <= 0 else self.max_batch_size
+        scores = []
+        for start in range(0, batch_size, chunk_size):
+            if chunk_size < batch_size:
+                chunk = {key: value[start:start + chunk_size] for key, value in inputs.items()}
+            else:
+                chunk = inputs
+            scores.append(model(chunk))
+        return _concatenate(scores)
+
+    def _predict_sharded(self, inputs):
+        batch_size = inputs['current_img'].shape[0]
+        shard_size = -(-batch_size // len(self.models))   # ceil division
+        shards = []
+        for start, device in zip(range(0, batch_size, shard_size), self.devices):
+            shards.append({key: value[start:start + shard_size].to(device, non_blocking=True)
+                           for key, value in inputs.items()})
+        predict_fns = [partial(self._predict_chunks, model) for model in self.models[:len(shards)]]
+        scores = parallel_apply(predict_fns, shards)
+        return _concatenate([score.to(self.devices[0]) if torch.is_tensor(score) else score for score in scores])
 
+    def _inference_context(self):
+        if self._cpu_inference is None:
+            return contextlib.nullcontext()
+        return cpu_autocast(self._cpu_inference)
 
 
+def _concatenate(scores):
+    if torch.is_tensor(scores[0]):
+        scores = torch.cat(scores, dim=0)
+        return scores.float() if scores.dtype == torch.bfloat16 else scores
+    return np.concatenate(scores, axis=0)
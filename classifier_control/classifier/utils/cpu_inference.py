@@ -0,0 +1,94 @@
+""" Optimizations of the learned costs for inference on CPU-only machines. """
+import contextlib
+
+import torch
+import torch.nn as nn
+
+from classifier_control.classifier.utils.general_utils import AttrDict
+
+
+CPU_INFERENCE_DEFAULTS = AttrDict(
+    fold_batchnorm=True,    # fold eval-mode batch norms into the preceding convolution or linear layer
+    channels_last=True,     # NHWC memory format for the convolutions
+    bf16=False,             # bfloat16 autocast, needs a CPU with native bf16 support to pay off
+    num_threads=None,       # intra-op threads, None keeps the torch default
+)
+
+
+def _fold_into(layer, bn):
+    """ Folds the statistics and affine parameters of bn into the weights and bias of layer, in place """
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps) if bn.affine else 1. / torch.sqrt(bn.running_var + bn.eps)
+    shift = -bn.running_mean * scale
+    if bn.affine:
+        shift = shift + bn.bias
+    if layer.bias is not None:
+        shift = shift + layer.bias * scale
+    layer.weight.data.mul_(scale.view((-1,) + (1,) * (layer.weight.dim() - 1)))
+    layer.bias = nn.Parameter(shift.detach())
+
+
+def _can_fold(layer, bn):
+    return isinstance(bn, (nn.BatchNorm1d, nn.BatchNorm2d)) and bn.track_running_stats \
+           and bn.running_mean is not None \
+           and not isinstance(layer, nn.modules.conv._ConvTransposeNd) \
+           and isinstance(getattr(layer, 'weight', None), torch.Tensor) and hasattr(layer, 'bias') \
+           and layer.weight.shape[0] == bn.num_features
+
+
+@torch.no_grad()
+def fold_batchnorm(module):
+    """
+    Folds every batch norm that directly follows a convolution or linear layer in a Sequential into that layer and
+    replaces it with an Identity, the module names are kept. Only valid for inference in eval mode.
+    :return: number of folded batch norms
+    """
+    n_folded = 0
+    for child in module.children():
+        n_folded += fold_batchnorm(child)
+    if isinstance(module, nn.Sequential):
+        names = list(module._modules.keys())
+        for name, next_name in zip(names[:-1], names[1:]):
+            layer, bn = module._modules[name], module._modules[next_name]
+            if _can_fold(layer, bn):
+                _fold_into(layer, bn)
+                module._modules[next_name] = nn.Identity()
+                n_folded += 1
+    return n_folded
+
+
+def optimize_for_cpu(model, params):
+    """
+    Prepares an eval-mode model for CPU inference. Options the installed torch does not support, channels_last before
+    torch 1.5 and bf16 autocast before torch 1.10, are switched off in params with a warning.
+    :param params: options as in CPU_INFERENCE_DEFAULTS
+    """
+    model.eval()
+    if params.channels_last and not hasattr(torch, 'channels_last'):
+        print('warning: torch {} has no channels_last memory format, keeping the contiguous layout'.format(
+            torch.__version__))
+        params.channels_last = False
+    if params.bf16 and not hasattr(torch, 'autocast'):
+        print('warning: torch {} has no cpu autocast, running in fp32'.format(torch.__version__))
+        params.bf16 = False
+    if params.fold_batchnorm:
+        print('folded {} batch norm layers'.format(fold_batchnorm(model)))
+    if params.channels_last:
+        model.to(memory_format=torch.channels_last)
+    if params.num_threads is not None:
+        torch.set_num_threads(params.num_threads)
+    return model
+
+
+def prepare_cpu_inputs(inputs, params):
+    """ Converts the image inputs to the memory format of a model optimized with optimize_for_cpu """
+    if not params.channels_last or not hasattr(torch, 'channels_last'):
+        return inputs
+    return {key: value.contiguous(memory_format=torch.channels_last) if torch.is_tensor(value) and value.dim() == 4
+            else value for key, value in inputs.items()}
+
+
+def cpu_autocast(params):
+    """ Autocast context for predictions, disabled unless bf16 is set and supported by torch """
+    if not hasattr(torch, 'autocast'):
+        return contextlib.nullcontext()
+    return torch.autocast(device_type='cpu', dtype=torch.bfloat16, enabled=bool(params.bf16))
@@ -0,0 +1,78 @@
+""" Exports the scoring function of a test-time distance model as a traced TorchScript module.
+
+The exported module maps (current_img, goal_img), both batch x 3 x height x width in [-1, 1], to costs of shape batch
+and can be loaded with TracedCostEvaluation without the training code.
+
+The module is traced on --device, the device it is meant to be loaded on. The score methods build their tensors from
+the inputs, so the artifact can also be mapped to another device, see benchmarks/check_traced_cost_device.py.
+
+usage: python export_traced_cost.py <model class> <checkpoint> <output file> [--img_sz 64 64] [--batch_size 200]
+    [--device cpu]
+e.g. python export_traced_cost.py classifier_control.classifier.models.latent_space.LatentSpaceTestTime \
+    <exp_dir>/weights/weights_ep99.pth latent_space_cost.pt
+"""
+import argparse
+import importlib
+
+import torch
+import torch.nn as nn
+
+from classifier_control.classifier.utils.DistFuncEvaluation import DistFuncEvaluation
+
+
+class CostScorer(nn.Module):
+    """ Exposes the score method of a test-time model as forward, which is what gets traced """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, current_img, goal_img):
+        return self.model.score(current_img, goal_img)
+
+
+def load_model_class(name):
+    module_name, class_name = name.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def export(model_class, checkpoint_path, output_path, img_sz, batch_size, device=None):
+    """
+
+    :param device: device the module is traced on, defaults to cuda if available
+    """
+    testparams = {
+        'batch_size': batch_size,
+        'data_conf': {'img_sz': img_sz},
+        'classifier_restore_path': checkpoint_path,
+        'device': device,
+    }
+    evaluation = DistFuncEvaluation(model_class, testparams)
+    scorer = CostScorer(evaluation.model).eval()
+
+    device = evaluation.get_device()
+    example_inputs = (torch.rand(batch_size, 3, img_sz[0], img_sz[1], device=device) * 2 - 1,
+                      torch.rand(batch_size, 3, img_sz[0], img_sz[1], device=device) * 2 - 1)
+    with torch.no_grad():
+        # check_trace is disabled since the Q-functions sample random actions
+        traced = torch.jit.trace(scorer, example_inputs, check_trace=False)
+        eager_scores = scorer(*example_inputs)
+        traced_scores = traced(*example_inputs)
+    print('max difference eager vs traced: {}'.format((eager_scores - traced_scores).abs().max().item()))
+
+    torch.jit.save(traced, output_path)
+    print('saved traced cost to {}'.format(output_path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model', help='test-time model class, e.g. '
+                                      'classifier_control.classifier.models.q_function.QFunctionTestTime')
+    parser.add_argument('checkpoint', help='weights file, params.yaml is expected two directories above')
+    parser.add_argument('output', help='file the traced module is written to')
+    parser.add_argument('--img_sz', nargs=2, type=int, default=[64, 64])
+    parser.add_argument('--batch_size', default=200, type=int, help='batch size of the example inputs')
+    parser.add_argument('--device', default=None, help='device to trace on, defaults to cuda if available')
+    args = parser.parse_args()
+
+    export(load_model_class(args.model), args.checkpoint, args.output, args.img_sz, args.batch_size, args.device)
@@ -1,8 +1,7 @@
 import numpy as np
-from PIL import Image
-from torchvision.transforms import Resize
 import torch
 from functools import partial, reduce
+from classifier_control.classifier.utils.video_resize import resize_batch
 
 def str2int(str):
     try:
@@ -64,40 +63,10 @@ def get_clipped_optimizer(*args, optimizer_type=None, **kwargs):
     return ClipGradOptimizer(*args, **kwargs)
 
 
-def resize_video(video, size):
-    # return video
-    # video = ch_first2last(video).astype(np.uint8)
-    # lazy transform ;)
-    # transformed_video = video
-
-    # moviepy is memory inefficient
-    # clip = mpy.ImageSequenceClip(np.split(images, images.shape[0]), fps=1)
-    # clip = clip.resize((self.img_sz, self.img_sz))
-    # images = np.array([frame for frame in clip.iter_frames()])
-
-    # looping over time is too slow for long videos
-    transformed_video = np.stack([np.asarray(Resize(size)(Image.fromarray(im))) for im in video], axis=0)
-
-    # Using pytorch is also slow
-    # x = torch.from_numpy(video.transpose((0,3,1,2))).float()
-    # x = F.interpolate(x, size)
-    # transformed_video = x.data.numpy().transpose((0,2,3,1))
-
-    # It seems that cv2 can resize images with up to 512 channels, which is what this implementation uses
-    # It is as fast as the looping implementation above
-    # sh = list(video.shape)
-    # x = video.transpose((1, 2, 3, 0)).reshape(sh[1:3]+[-1])
-    # n_split = math.ceil(x.shape[2] / 512.0)
-    # x = np.array_split(x, n_split, 2)
-    # x = np.concatenate([cv2.resize(im, size) for im in x], 2)
-    # transformed_video = x.reshape(list(size) + [sh[3], sh[0]]).transpose((3, 0, 1, 2))
-
-    # scipy.ndimage.zoom seems to be even slower than looping. Wow.
-    # sh = [video.shape[1] / size[0], video.shape[2] / size[1]]
-    # transformed_video = ndimage.zoom(video, [1] + sh + [1])
-
-    # transformed_video = ch_last2first(transformed_video).astype(np.float32)
-    return transformed_video
+def resize_video(video, size, backend='default'):
+    """ Resizes a [T, H, W, C] clip (or a [B, T, H, W, C] batch of clips) to size=(height, width).
+    All frames are resized in one call, see video_resize.py for the available backends. """
+    return resize_batch(video, size, backend=backend)
 
 
 def make_recursive(fn, *argv, **kwargs):
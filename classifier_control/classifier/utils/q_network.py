@@ -26,12 +26,17 @@ class QNetwork(torch.nn.Module):
 #         self.linear6 = Linear(in_dim=128, out_dim=1, builder=self._hp.builder)
 
     def forward(self, image_pairs, actions):
+        return self.head(self.embed(image_pairs), actions)
+
+    def embed(self, image_pairs):
         if self._hp.low_dim:
             embeddings = image_pairs
         else:
             embeddings = self.encoder(image_pairs).view(image_pairs.size(0), -1)
             
-        e = F.relu(self.linear1(embeddings))
+        return F.relu(self.linear1(embeddings))
+
+    def head(self, e, actions):
         e = torch.cat([e, actions], dim=1)
 #         e = F.relu(self.linear2(e))
 #         e = F.relu(self.linear3(e))
@@ -54,18 +59,23 @@ class DistQNetwork(torch.nn.Module):
             
         
         self.linear2 = Linear(in_dim=128 + self._hp.action_size, out_dim=128, builder=self._hp.builder)
-        self.linear3 = Linear(in_dim=128, out_dim=10, builder=self._hp.builder)
+        self.linear3 = Linear(in_dim=128, out_dim=self._hp.n_bins, builder=self._hp.builder)
 #         self.linear4 = Linear(in_dim=128, out_dim=128, builder=self._hp.builder)
 #         self.linear5 = Linear(in_dim=128, out_dim=128, builder=self._hp.builder)
 #         self.linear6 = Linear(in_dim=128, out_dim=1, builder=self._hp.builder)
 
     def forward(self, image_pairs, actions):
+        return self.head(self.embed(image_pairs), actions)
+
+    def embed(self, image_pairs):
         if self._hp.low_dim:
             embeddings = image_pairs
         else:
             embeddings = self.encoder(image_pairs).view(image_pairs.size(0), -1)
             
-        e = F.relu(self.linear1(embeddings))
+        return F.relu(self.linear1(embeddings))
+
+    def head(self, e, actions):
         e = torch.cat([e, actions], dim=1)
         e = F.relu(self.linear2(e))
 #         e = F.relu(self.linear3(e))
@@ -73,3 +83,23 @@ class DistQNetwork(torch.nn.Module):
 #         e = F.relu(self.linear5(e))
         qvalue =  F.softmax(self.linear3(e)) #self.linear6(e)
         return qvalue
+
+
+def evaluate_sampled_actions(network, image_pairs, actions, chunk_size=None):
+    """
+    Evaluates a Q-network for several action samples per observation/goal pair, every pair is encoded only once
+    :param actions: [n_samples, batch, action_size]
+    :param chunk_size: maximum number of action samples evaluated in one batched call, None evaluates all at once
+    :return: network outputs with shape [n_samples, batch, ...]
+    """
+    n_samples, batch_size = actions.shape[:2]
+    embeddings = network.embed(image_pairs)
+    chunk_size = chunk_size or n_samples
+    outputs = []
+    for start in range(0, n_samples, chunk_size):
+        chunk_actions = actions[start:start + chunk_size]
+        n_chunk = chunk_actions.shape[0]
+        chunk_embeddings = embeddings.unsqueeze(0).expand(n_chunk, -1, -1).reshape(n_chunk * batch_size, -1)
+        output = network.head(chunk_embeddings, chunk_actions.reshape(n_chunk * batch_size, -1))
+        outputs.append(output.view((n_chunk, batch_size) + output.shape[1:]))
+    return torch.cat(outputs, dim=0)
@@ -0,0 +1,45 @@
+""" Loads learned costs exported with export_traced_cost.py, only depends on torch. """
+import torch
+
+
+class TracedCostEvaluation():
+    """ Drop-in replacement for DistFuncEvaluation that runs a traced (current_img, goal_img) -> cost module """
+
+    def __init__(self, traced_path, device=None, max_batch_size=-1):
+        """
+
+        :param traced_path: file written by export_traced_cost.py
+        :param device: device the module is mapped to, defaults to cuda if available
+        :param max_batch_size: largest batch scored in one call, -1 for no limit
+        """
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device = torch.device(device)
+        self.model = torch.jit.load(traced_path, map_location=self.device)
+        self.model.eval()
+        self.max_batch_size = max_batch_size
+        self._goal_img = None
+
+    def get_device(self):
+        return self.device
+
+    def set_goal(self, goal_img):
+        """ Sets the goal, 1 x channel x height x width, that predict compares inputs without 'goal_img' to """
+        self._goal_img = goal_img
+
+    def predict(self, inputs):
+        current_img = inputs['current_img']
+        if 'goal_img' in inputs:
+            goal_img = inputs['goal_img']
+        else:
+            goal_img = self._goal_img.expand((current_img.shape[0],) + self._goal_img.shape[1:])
+
+        batch_size = current_img.shape[0]
+        chunk_size = batch_size if self.max_batch_size <= 0 else self.max_batch_size
+        with torch.no_grad():
+            scores = [self.model(current_img[start:start + chunk_size], goal_img[start:start + chunk_size])
+                      for start in range(0, batch_size, chunk_size)]
+        return torch.cat(scores, dim=0)
+
+    def visualize_test_time(self, content_dict, visualize_indices, verbose_folder):
+        pass
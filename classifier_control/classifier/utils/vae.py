@@ -33,6 +33,10 @@ class VAE(torch.nn.Module):
         z =  self.linear2(e) #self.linear6(e)
         mu, logvar = z[:, :self._hp.hidden_size], z[:, self._hp.hidden_size:]
         return mu, logvar
+
+    def encode_mean(self, image):
+        """ Deterministic latent for inference, runs the encoder only and returns mu """
+        return self.encode(image)[0]
         
     def decode(self, z):
         e = F.relu(self.linear3(z))
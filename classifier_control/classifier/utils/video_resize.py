@@ -0,0 +1,99 @@
+import math
+import time
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+
+CV2_MAX_CHANNELS = 512   # cv2.resize handles images with up to 512 channels
+
+CV2_MODES = {'bilinear': cv2.INTER_LINEAR, 'bicubic': cv2.INTER_CUBIC}
+PIL_MODES = {'bilinear': Image.BILINEAR, 'bicubic': Image.BICUBIC}
+
+
+def resize_pil(frames, size, mode='bilinear'):
+    """ Reference implementation, resizes frame by frame with PIL. frames: [N, H, W, C] uint8, size: (height, width) """
+    return np.stack([np.asarray(Image.fromarray(im).resize((size[1], size[0]), PIL_MODES[mode])) for im in frames],
+                    axis=0)
+
+
+def resize_cv2(frames, size, mode='bilinear'):
+    """ Packs all frames into the channel dimension so that cv2 resizes up to 512 channels per call. """
+    n, h, w, c = frames.shape
+    x = frames.transpose((1, 2, 3, 0)).reshape(h, w, c * n)
+    n_split = math.ceil(x.shape[2] / float(CV2_MAX_CHANNELS))
+    resized = []
+    for chunk in np.array_split(x, n_split, 2):
+        chunk = cv2.resize(np.ascontiguousarray(chunk), (size[1], size[0]), interpolation=CV2_MODES[mode])
+        if chunk.ndim == 2:
+            chunk = chunk[..., None]    # cv2 drops single channel dimensions
+        resized.append(chunk)
+    x = np.concatenate(resized, 2)
+    return np.ascontiguousarray(x.reshape(size[0], size[1], c, n).transpose((3, 0, 1, 2)))
+
+
+def resize_torch(frames, size, mode='bilinear'):
+    """ Resizes all frames in a single F.interpolate call using the intra-op CPU threads. """
+    x = torch.from_numpy(np.ascontiguousarray(frames)).permute(0, 3, 1, 2).float()
+    x = F.interpolate(x, size=tuple(size), mode=mode, align_corners=False)
+    if frames.dtype == np.uint8:
+        x = x.round_().clamp_(0, 255)
+    return x.permute(0, 2, 3, 1).contiguous().numpy().astype(frames.dtype)
+
+
+BACKENDS = {
+    'pil': resize_pil,
+    'cv2': resize_cv2,
+    'torch': resize_torch,
+}
+
+# fastest backend per (input shape, size, mode), filled on first use of every shape with backend='auto'
+_auto_backends = {}
+
+
+def _is_downsampling(frames, size):
+    return size[0] < frames.shape[1] or size[1] < frames.shape[2]
+
+
+def _default_backend(frames, size):
+    """
+    Fixed choice for reproducible preprocessing: cv2 matches PIL within the tolerance of test_video_resize.py when
+    upsampling, but neither cv2 nor torch antialias like PIL when downsampling, so PIL is kept there
+    """
+    return 'pil' if _is_downsampling(frames, size) else 'cv2'
+
+
+def _select_backend(frames, size, mode):
+    if _is_downsampling(frames, size):
+        return 'pil'
+    key = (frames.shape, tuple(size), mode, frames.dtype.str)
+    if key not in _auto_backends:
+        timings = {}
+        for name in ['cv2', 'torch']:
+            start = time.time()
+            BACKENDS[name](frames, size, mode)
+            timings[name] = time.time() - start
+        _auto_backends[key] = min(timings, key=timings.get)
+    return _auto_backends[key]
+
+
+def resize_batch(video, size, backend='default', mode='bilinear'):
+    """
+    Resizes a clip [T, H, W, C] or a minibatch of clips [B, T, H, W, C] in one call.
+    :param size: (height, width)
+    :param backend: one of 'default', 'auto', 'cv2', 'torch', 'pil'. 'default' uses cv2 for upsampling and PIL for
+    downsampling. 'auto' times cv2 and torch once per clip shape and keeps the faster one, so the output may differ
+    between runs and machines; it also uses PIL for downsampling
+    :param mode: 'bilinear' or 'bicubic'
+    """
+    lead_shape = video.shape[:-3]
+    frames = video.reshape((-1,) + video.shape[-3:])
+    if backend == 'default':
+        backend = _default_backend(frames, size)
+    elif backend == 'auto':
+        backend = _select_backend(frames, size, mode)
+    resized = BACKENDS[backend](frames, size, mode)
+    return resized.reshape(lead_shape + resized.shape[1:])
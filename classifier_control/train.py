@@ -20,7 +20,9 @@ from classifier_control.classifier.utils.general_utils import AverageMeter, Recu
 from classifier_control.classifier.utils.checkpointer import CheckpointHandler, save_cmd, save_git, get_config_path
 from classifier_control.classifier.utils.general_utils import AttrDict
 
-from classifier_control.classifier.datasets.data_loader import FixLenVideoDataset
+from classifier_control.classifier.datasets.data_loader import FixLenVideoDataset, LowDimDataset, normalize_images
+from classifier_control.classifier.datasets.device_loader import DeviceDataLoader
+from classifier_control.classifier.datasets.replay_store import ReplayDataset
 
 from classifier_control.classifier.utils.trainer_base import BaseTrainer
 
@@ -63,6 +65,8 @@ class ModelTrainer(BaseTrainer):
         
         self._hp = self._default_hparams()
         self.override_defaults(conf)  # override defaults with config file
+        if self._hp.device_dataset:
+            DeviceDataLoader.check_data_conf(data_conf)
 
         self._hp.set_hparam('exp_path', make_path(exp_dir, args.path, args.prefix, args.new_dir))
         self.log_dir = log_dir = os.path.join(self._hp.exp_path, 'events')
@@ -96,7 +100,19 @@ class ModelTrainer(BaseTrainer):
             model.to(self.device)
             model.device = self.device
             if phase is not 'test':
-                loader = FixLenVideoDataset(self._hp.data_dir, model._hp, data_conf, phase, shuffle=True).get_data_loader(self._hp.batch_size)
+                if data_conf.get('replay_store', False):
+                    dataset = ReplayDataset(self._hp.data_dir, model._hp, data_conf, phase, shuffle=True,
+                                            frame_sampler=model.get_frame_sampler())
+                elif data_conf.get('state_only', False):
+                    dataset = LowDimDataset(self._hp.data_dir, model._hp, data_conf, phase, shuffle=True)
+                else:
+                    frame_sampler = model.get_frame_sampler() if data_conf.get('sparse_frames', False) else None
+                    dataset = FixLenVideoDataset(self._hp.data_dir, model._hp, data_conf, phase, shuffle=True,
+                                                 frame_sampler=frame_sampler)
+                if self._hp.device_dataset:
+                    loader = DeviceDataLoader(dataset, self._hp.batch_size, self.device)
+                else:
+                    loader = dataset.get_data_loader(self._hp.batch_size)
                 return model, loader
             else:
                 return model
@@ -217,6 +233,7 @@ class ModelTrainer(BaseTrainer):
             'lr': 1e-3,
             'momentum': 0,      # momentum in RMSProp / SGD optimizer
             'adam_beta': 0.9,       # beta1 param in Adam
+            'device_dataset': False,    # load the whole train and val split into device memory, see DeviceDataLoader
         }
         # add new params to parent params
         parent_params = HParams()
@@ -259,7 +276,7 @@ class ModelTrainer(BaseTrainer):
 
         for self.batch_idx, sample_batched in enumerate(self.train_loader):
             data_load_time.update(time.time() - end)
-            inputs = AttrDict(map_dict(lambda x: x.to(self.device), sample_batched))
+            inputs = self.prepare_inputs(sample_batched)
 
             self.optimizer.zero_grad()
             output = self.model(inputs)
@@ -291,6 +308,13 @@ class ModelTrainer(BaseTrainer):
             del output, losses
             self.global_step = self.global_step + 1
     
+    def prepare_inputs(self, sample_batched):
+        # the loader pins the batches, so the copies are asynchronous and the host does not wait for them
+        inputs = AttrDict(map_dict(lambda x: x.to(self.device, non_blocking=True), sample_batched))
+        if 'demo_seq_images' in inputs:
+            inputs.demo_seq_images = normalize_images(inputs.demo_seq_images)
+        return inputs
+
     def val(self, test_control=True):
         print('Running Testing')
         if self.args.test_prediction:
@@ -301,7 +325,7 @@ class ModelTrainer(BaseTrainer):
             losses_meter = RecursiveAverageMeter()
             with autograd.no_grad():
                 for batch_idx, sample_batched in enumerate(self.val_loader):
-                    inputs = AttrDict(map_dict(lambda x: x.to(self.device), sample_batched))
+                    inputs = self.prepare_inputs(sample_batched)
 
                     output = self.model_val(inputs)
                     losses = self.model_val.loss(output)
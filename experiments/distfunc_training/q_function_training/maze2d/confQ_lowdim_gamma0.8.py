@@ -21,7 +21,8 @@ configuration = AttrDict(configuration)
 data_config = AttrDict(
                 img_sz=(64, 64),
                 sel_len=-1,
-                T=31)
+                T=31,
+                state_only=True)   # low_dim only uses states and actions, the images are never loaded
 
 model_config = {
     'low_dim':True,